@@ -0,0 +1,184 @@
+"""
+Scores many positions at once with NumPy, for tuning and labelling datasets offline.
+Positions (GameStates or FEN strings) are encoded into an (N, 64) array of piece codes, 0 for an empty square and
+1-12 for Evaluation.PIECES, and the material and piece-square totals are summed for all of them in a few array
+operations. The scores are the ones SmartMoveFinder.scoreboard gives: centipawns from white's point of view.
+The encoding only pays off for FEN strings and encode() arrays: a GameState already keeps its totals up to date,
+so GameStates are scored with scoreboard one by one, and a batch of them is no faster than a loop.
+
+    python -m Chess.BatchEval [fens.txt]    positions per second, checked against scoreboard
+
+NumPy is only needed by this module.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from Chess import Evaluation, BitboardEngine, SmartMoveFinder
+
+FEN_PIECES = "PNBRQKpnbrqk"  # Evaluation.PIECES in FEN letters
+SQUARE_CHARS = {piece: FEN_PIECES[i] for i, piece in enumerate(Evaluation.PIECES)}
+SQUARE_CHARS['--'] = '.'
+CODES = np.zeros(256, np.int8)
+for i, ch in enumerate(FEN_PIECES):
+    CODES[ord(ch)] = i + 1
+VALID = np.zeros(256, bool)  # what expand() can leave on a square
+VALID[[ord(ch) for ch in FEN_PIECES + "."]] = True
+SQUARES = np.arange(64)
+cache = {}  # tables() for one Evaluation.version
+
+
+"""
+(N, 64) int8 array of piece codes, square r * 8 + c as on GameState.board
+"""
+
+
+def encode(positions):
+    boards = []
+    for position in positions:
+        if isinstance(position, str):
+            board = position.split(" ", 1)[0]
+            if board.count("/") != 7:
+                raise ValueError("bad FEN: %r" % board)
+            boards.append(board)
+        else:
+            boards.append("/".join("".join(map(SQUARE_CHARS.__getitem__, row)) for row in position.board))
+    if not boards:
+        return np.zeros((0, 64), np.int8)
+    # every row ends in a "/", so a row of the wrong length shows up as a "/" out of place
+    text = expand("/".join(boards) + "/").encode("ascii", "replace")
+    squares = np.frombuffer(text, np.uint8)
+    rows = squares[:len(squares) // 9 * 9].reshape(-1, 9)
+    if len(squares) != 72 * len(boards) or not (
+            (rows[:, 8] == ord("/")).all() and VALID[rows[:, :8]].all()):
+        for board in boards:
+            if any(len(row) != 8 or not VALID[np.frombuffer(row.encode("ascii", "replace"), np.uint8)].all()
+                   for row in expand(board).split("/")):
+                raise ValueError("bad FEN: %r" % board)
+    return CODES[rows[:, :8]].reshape(-1, 64)
+
+
+"""
+FEN board text to one character per square, a whole batch in one go; the "/" between rows stay
+"""
+
+
+def expand(text):
+    for n in range(8, 1, -1):
+        text = text.replace(str(n), "." * n)
+    return text.replace("1", ".")
+
+
+"""
+The evaluation tables as arrays indexed by [code, square], black's values negative so a row sum is white - black
+"""
+
+
+def tables():
+    if Evaluation.version in cache:
+        return cache[Evaluation.version]
+    sign = np.repeat([1, -1], 6 * 64).reshape(12, 64)
+    mg = np.zeros((13, 64), np.int64)
+    eg = np.zeros((13, 64), np.int64)
+    mg[1:] = np.array(Evaluation.mgTable).reshape(12, 64) * sign
+    eg[1:] = np.array(Evaluation.egTable).reshape(12, 64) * sign
+    phase = np.zeros(13, np.int64)
+    phase[1:] = [Evaluation.phaseWeights[piece[1]] for piece in Evaluation.PIECES]
+    cache.clear()  # load() changed the tables in place
+    cache[Evaluation.version] = mg, eg, phase
+    return cache[Evaluation.version]
+
+
+"""
+Scores for a batch of GameStates or FEN strings (or an array from encode()), as an int64 array.
+FEN strings are encoded and summed; GameStates go through scoreboard, which already reads the totals they keep
+and gives the ones getValidMoves() found to be over the checkmate and stalemate scores.
+"""
+
+
+def evaluate_batch(positions):
+    if isinstance(positions, np.ndarray):
+        return taper(*totals(positions))
+    positions = list(positions)
+    fens = [i for i, position in enumerate(positions) if isinstance(position, str)]
+    states = [i for i, position in enumerate(positions) if not isinstance(position, str)]
+    scores = np.zeros(len(positions), np.int64)
+    if fens:
+        scores[fens] = taper(*totals(encode([positions[i] for i in fens])))
+    if states:
+        scores[states] = np.fromiter((SmartMoveFinder.scoreboard(positions[i]) for i in states), np.int64, len(states))
+    return scores
+
+
+"""
+Midgame and endgame scores (white - black) and phase of each row of piece codes
+"""
+
+
+def totals(codes):
+    mg, eg, phase = tables()
+    return mg[codes, SQUARES].sum(axis=1), eg[codes, SQUARES].sum(axis=1), phase[codes].sum(axis=1)
+
+
+"""
+Evaluation.taper on arrays
+"""
+
+
+def taper(mgscore, egscore, phases):
+    phases = np.minimum(phases, Evaluation.MAX_PHASE)
+    return (mgscore * phases + egscore * (Evaluation.MAX_PHASE - phases)) // Evaluation.MAX_PHASE
+
+
+"""
+Positions from random games, for when there is no FEN file to read
+"""
+
+
+def randompositions(count, seed=0):
+    rng = np.random.default_rng(seed)
+    fens = []
+    while len(fens) < count:
+        gs = BitboardEngine.GameState()
+        for _ in range(120):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(moves[rng.integers(len(moves))])
+            fens.append(gs.to_fen())
+    return fens[:count]
+
+
+def main(path=None):
+    if path is not None:
+        with open(path) as f:
+            fens = [line.strip() for line in f if line.strip()]
+    else:
+        fens = randompositions(20000)
+
+    start = time.perf_counter()
+    codes = encode(fens)
+    encoded = time.perf_counter()
+    scores = evaluate_batch(codes)
+    done = time.perf_counter()
+    print("positions: %d\nencode: %d positions/s\nevaluate: %d positions/s" %
+          (len(fens), len(fens) / (encoded - start), len(fens) / (done - encoded)))
+
+    states = [BitboardEngine.GameState.from_fen(fen) for fen in fens]
+    start = time.perf_counter()
+    statescores = evaluate_batch(states)
+    batch = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = np.array([SmartMoveFinder.scoreboard(gs) for gs in states])
+    scalar = time.perf_counter() - start
+    print("GameStates: %d positions/s, scoreboard %d positions/s" % (len(states) / batch, len(states) / scalar))
+    # from_fen doesn't look for mate, so the FEN scores should match too
+    mismatches = int((scores != expected).sum() + (statescores != expected).sum())
+    print("mismatches: %d" % mismatches)
+    return mismatches
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main(sys.argv[1] if len(sys.argv) > 1 else None) else 0)
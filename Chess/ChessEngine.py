@@ -1,3 +1,35 @@
+from functools import lru_cache
+
+from Chess import Evaluation, Zobrist
+
+# castling rights are kept as an int of these bits
+WKS = 1
+WQS = 2
+BKS = 4
+BQS = 8
+FEN_CASTLES = {"K": WKS, "Q": WQS, "k": BKS, "q": BQS}
+CASTLE_PIECES = {WKS: ((7, 4, "wk"), (7, 7, "wr")), WQS: ((7, 4, "wk"), (7, 0, "wr")),
+                 BKS: ((0, 4, "bk"), (0, 7, "br")), BQS: ((0, 4, "bk"), (0, 0, "br"))}  # king and rook each right needs
+
+# squares a knight or king on r * 8 + c attacks, and the directions the sliders move in
+KNIGHT_TARGETS = [[(r + dr) * 8 + c + dc
+                   for dr, dc in [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+                   if 0 <= r + dr <= 7 and 0 <= c + dc <= 7] for r in range(8) for c in range(8)]
+KING_TARGETS = [[(r + dr) * 8 + c + dc for dr in range(-1, 2) for dc in range(-1, 2)
+                 if (dr or dc) and 0 <= r + dr <= 7 and 0 <= c + dc <= 7] for r in range(8) for c in range(8)]
+SLIDER_DIRS = {"r": [(0, 1), (-1, 0), (0, -1), (1, 0)], "b": [(1, 1), (-1, 1), (1, -1), (-1, -1)]}
+SLIDER_DIRS["q"] = SLIDER_DIRS["r"] + SLIDER_DIRS["b"]
+
+# rights left after a move from or to each square, r * 8 + c
+CASTLE_MASKS = [15] * 64
+CASTLE_MASKS[0] = 15 & ~BQS  # a8
+CASTLE_MASKS[4] = 15 & ~(BKS | BQS)  # e8
+CASTLE_MASKS[7] = 15 & ~BKS  # h8
+CASTLE_MASKS[56] = 15 & ~WQS  # a1
+CASTLE_MASKS[60] = 15 & ~(WKS | WQS)  # e1
+CASTLE_MASKS[63] = 15 & ~WKS  # h1
+
+
 class GameState:
 
     def __init__(self):
@@ -10,29 +42,256 @@ class GameState:
             ['--', '--', '--', '--', '--', '--', '--', '--'],
             ['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
             ['wr', 'wn', 'wb', 'wq', 'wk', 'wb', 'wn', 'wr']]
+        self.whiteToMove = True
+        self.castle = WKS | WQS | BKS | BQS
+        self.enpassantsq = ()  # possible square for en passant
+        self.halfmoveStart = 0  # move counters of the position the game started from, see to_fen
+        self.fullmoveStart = 1
+        self.setup()
+
+    """
+    Everything else GameState keeps, worked out from the board, side to move, castle rights and en passant square
+    """
 
+    def setup(self):
         self.moveFunctions = {"p": self.getPawnMoves, "r": self.getRookMoves, "n": self.getKnightMoves,
                               "b": self.getBishopMoves, "q": self.getQueenMoves, "k": self.getKingMoves}
-        self.whiteToMove = True
-        self.moveLog = []
-
-        # saving the locations of the two kings on the board
-        self.wkloc = (7, 4)
-        self.bkloc = (0, 4)
         self.checkmate = False
         self.stalemate = False
         self.inCheck = False
         self.pins = []
         self.checks = []
-        self.enpassantsq = ()  # possible square for en passant
-        self.castle = CastleRights(True, True, True, True)
-        self.castlelog = [CastleRights(self.castle.wks, self.castle.wqs, self.castle.bks, self.castle.bqs)]
+        self.loadPosition()
+
+    """
+    Sets up a position from a FEN string, e.g. GameState.from_fen("8/8/8/4k3/8/8/4P3/4K3 w - - 0 1").
+    Rows seen recently are reused from a cache, which keeps loading big FEN files fast.
+    Castling rights whose king or rook isn't on its square are dropped, a position without one king a side is a ValueError.
+    """
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("bad FEN: %r" % fen)
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError("bad FEN: %r" % fen)
+        gs = cls.__new__(cls)
+        board = []
+        for row in rows:
+            squares = parseFenRow(row)
+            if squares is None:
+                raise ValueError("bad FEN: %r" % fen)
+            board.append(list(squares))
+        gs.board = board
+        if fields[0].count("K") != 1 or fields[0].count("k") != 1:
+            raise ValueError("bad FEN, needs one king a side: %r" % fen)
+        if fields[1] not in ("w", "b"):
+            raise ValueError("bad FEN: %r" % fen)
+        gs.whiteToMove = fields[1] == "w"
+        gs.castle = 0
+        if fields[2] != "-":
+            for ch in fields[2]:
+                if ch not in FEN_CASTLES or gs.castle & FEN_CASTLES[ch]:
+                    raise ValueError("bad FEN castling field: %r" % fen)
+                gs.castle |= FEN_CASTLES[ch]
+        for right, pieces in CASTLE_PIECES.items():
+            if gs.castle & right and any(board[r][c] != piece for r, c, piece in pieces):
+                gs.castle &= ~right
+        eprank = "6" if gs.whiteToMove else "3"  # behind a pawn the other side has just pushed two squares
+        if fields[3] == "-":
+            gs.enpassantsq = ()
+        elif len(fields[3]) == 2 and fields[3][0] in Move.filesToCols and fields[3][1] == eprank:
+            gs.enpassantsq = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        else:
+            raise ValueError("bad FEN: %r" % fen)
+        try:
+            gs.halfmoveStart = int(fields[4]) if len(fields) > 4 else 0
+            gs.fullmoveStart = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("bad FEN: %r" % fen)
+        gs.setup()
+        return gs
+
+    """
+    FEN string of the current position
+    """
+
+    def to_fen(self):
+        rows = []
+        for row in self.board:
+            text = ""
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                else:
+                    if empty:
+                        text += str(empty)
+                        empty = 0
+                    text += piece[1].upper() if piece[0] == 'w' else piece[1]
+            if empty:
+                text += str(empty)
+            rows.append(text)
+
+        castle = "".join(ch for ch, bit in FEN_CASTLES.items() if self.castle & bit)
+
+        if self.enpassantsq:
+            enpassant = Move.colsToFiles[self.enpassantsq[1]] + Move.rowsToRanks[self.enpassantsq[0]]
+        else:
+            enpassant = "-"
+
+        return "%s %s %s %s %d %d" % ("/".join(rows), "w" if self.whiteToMove else "b", castle or "-", enpassant,
+                                      self.halfmove, self.fullmove())
+
+    """
+    The fullmove number of the current position, it goes up after every black move
+    """
+
+    def fullmove(self):
+        blackstarted = self.whiteToMove == (len(self.moveLog) % 2 == 1)
+        return self.fullmoveStart + (len(self.moveLog) + blackstarted) // 2
+
+    """
+    A copy of the current position to search on, e.g. from another thread: the same board, side to move, rights,
+    move counters and repetition counts, without the move log, so it costs the same however long the game is.
+    Only the positions since the last capture or pawn move can repeat, so only those are counted again.
+    """
+
+    def copy(self):
+        gs = type(self).__new__(type(self))
+        gs.board = [row[:] for row in self.board]
+        gs.whiteToMove = self.whiteToMove
+        gs.castle = self.castle
+        gs.enpassantsq = self.enpassantsq
+        gs.halfmoveStart = self.halfmove
+        gs.fullmoveStart = self.fullmove()
+        gs.setup()
+        gs.repetitions = {}
+        for key in self.zobristlog[max(0, len(self.zobristlog) - 1 - self.halfmove):]:
+            gs.repetitions[key] = gs.repetitions.get(key, 0) + 1
+        return gs
+
+    """
+    Recomputes everything kept alongside the board (king squares, logs, position key, evaluation totals),
+    call it after editing the board by hand
+    """
+
+    def loadPosition(self):
+        # saving the locations of the two kings on the board
+        for r, row in enumerate(self.board):
+            if "wk" in row:
+                self.wkloc = (r, row.index("wk"))
+            if "bk" in row:
+                self.bkloc = (r, row.index("bk"))
+        self.moveLog = []
+        self.checkmate = False
+        self.stalemate = False
+        self.castlelog = [self.castle]
+        self.enpassantlog = [self.enpassantsq]
+        # 64-bit position key, covers the pieces, side to move, castle rights and en passant square
+        self.zobrist = Zobrist.hashposition(self)
+        self.zobristlog = [self.zobrist]
+        # halfmoves since the last capture or pawn move (fifty-move rule) and how often each position has come up
+        # (repetitions), both kept by makeMove and undoMove
+        self.halfmove = self.halfmoveStart
+        self.halfmovelog = [self.halfmove]
+        self.repetitions = {self.zobrist: 1}
+        # running material, midgame and endgame totals by color and the game phase, kept up to date by makeMove and undoMove
+        self.loadEval()
+
+    """
+    Computes the material, midgame and endgame totals, the phase and the piece count from scratch, call it after editing the board by hand
+    """
+
+    def loadEval(self):
+        index = Evaluation.PIECE_INDEX
+        values = Evaluation.pieceValues
+        weights = Evaluation.phaseWeights
+        mgTable = Evaluation.mgTable
+        egTable = Evaluation.egTable
+        material = {'w': 0, 'b': 0}
+        mg = {'w': 0, 'b': 0}
+        eg = {'w': 0, 'b': 0}
+        phase = 0
+        pieces = 0
+        sq = 0
+        for row in self.board:
+            for piece in row:
+                if piece != '--':
+                    pieces += 1
+                    i = index[piece] + sq
+                    material[piece[0]] += values[piece[1]]
+                    mg[piece[0]] += mgTable[i]
+                    eg[piece[0]] += egTable[i]
+                    phase += weights[piece[1]]
+                sq += 1
+        self.material = material
+        self.mg = mg
+        self.eg = eg
+        self.phase = phase
+        self.pieces = pieces  # kings included, tells the search when the tablebases apply
+
+    """
+    Adds (sign=1) or takes back (sign=-1) the change a move makes to the evaluation totals
+    """
+
+    def updateEval(self, move, sign):
+        mg = Evaluation.mgTable
+        eg = Evaluation.egTable
+        index = Evaluation.PIECE_INDEX
+        color = move.movedPiece[0]
+        start = index[move.movedPiece] + move.startRow * 8 + move.startCol
+        end = move.endRow * 8 + move.endCol
+        if move.isPawnPromotion:
+            piece = move.promotionChoice
+            end += index[color + piece]
+            self.material[color] += sign * (Evaluation.pieceValues[piece] - Evaluation.pieceValues["p"])
+            self.phase += sign * (Evaluation.phaseWeights[piece] - Evaluation.phaseWeights["p"])
+        else:
+            end += index[move.movedPiece]
+        self.mg[color] += sign * (mg[end] - mg[start])
+        self.eg[color] += sign * (eg[end] - eg[start])
+
+        if move.capturedPiece != '--':
+            enemy = move.capturedPiece[0]
+            if move.isenpassant:
+                capsq = index[move.capturedPiece] + move.startRow * 8 + move.endCol
+            else:
+                capsq = index[move.capturedPiece] + move.endRow * 8 + move.endCol
+            self.material[enemy] -= sign * Evaluation.pieceValues[move.capturedPiece[1]]
+            self.mg[enemy] -= sign * mg[capsq]
+            self.eg[enemy] -= sign * eg[capsq]
+            self.phase -= sign * Evaluation.phaseWeights[move.capturedPiece[1]]
+            self.pieces -= sign
+
+        if move.isCastle:
+            row = index[color + "r"] + move.endRow * 8
+            if move.endCol - move.startCol == 2:  # Kingside Castle
+                self.mg[color] += sign * (mg[row + 5] - mg[row + 7])
+                self.eg[color] += sign * (eg[row + 5] - eg[row + 7])
+            else:  # Queenside Castle
+                self.mg[color] += sign * (mg[row + 3] - mg[row])
+                self.eg[color] += sign * (eg[row + 3] - eg[row])
 
     """
     Makes a given move
     """
 
     def makeMove(self, move):
+        # take out the castle rights and en passant square of the old position, they are put back at the end
+        key = self.zobrist ^ Zobrist.CASTLE_RIGHTS_KEYS[self.castle] ^ \
+            Zobrist.enpassantkey(self.board, self.enpassantsq, self.whiteToMove) ^ Zobrist.TURN_KEY
+        key ^= Zobrist.PIECE_KEYS[move.movedPiece][move.startRow * 8 + move.startCol]
+        if move.capturedPiece != '--':
+            if move.isenpassant:
+                key ^= Zobrist.PIECE_KEYS[move.capturedPiece][move.startRow * 8 + move.endCol]
+            else:
+                key ^= Zobrist.PIECE_KEYS[move.capturedPiece][move.endRow * 8 + move.endCol]
+
+        self.updateEval(move, 1)
+
         self.board[move.startRow][move.startCol] = '--'
         self.board[move.endRow][move.endCol] = move.movedPiece
         self.moveLog.append(move)  # log the moves
@@ -46,15 +305,8 @@ class GameState:
 
         # Pawn Promotion
         if move.isPawnPromotion:
-            piece = "q"
-#             piece = input("""
-# Choose a piece!
-# q for queen
-# r for rook
-# b for bishop
-# n for knight
-#             """)
-            self.board[move.endRow][move.endCol] = move.movedPiece[0] + piece
+            self.board[move.endRow][move.endCol] = move.movedPiece[0] + move.promotionChoice
+        key ^= Zobrist.PIECE_KEYS[self.board[move.endRow][move.endCol]][move.endRow * 8 + move.endCol]
 
         # en passant
         if move.isenpassant:
@@ -69,16 +321,30 @@ class GameState:
 
         # Castle
         if move.isCastle:
+            rook = Zobrist.PIECE_KEYS[move.movedPiece[0] + "r"]
             if move.endCol - move.startCol == 2: # Kingside Castle
                 self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1] # move the rook
                 self.board[move.endRow][move.endCol + 1] = '--'
+                key ^= rook[move.endRow * 8 + move.endCol + 1] ^ rook[move.endRow * 8 + move.endCol - 1]
             else: # Queenside Castle
                 self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol -2]  # move the rook
                 self.board[move.endRow][move.endCol -2] = '--'
+                key ^= rook[move.endRow * 8 + move.endCol - 2] ^ rook[move.endRow * 8 + move.endCol + 1]
 
         # update castling rights
         self.castleRights(move)
-        self.castlelog.append(CastleRights(self.castle.wks, self.castle.wqs, self.castle.bks, self.castle.bqs))
+        self.castlelog.append(self.castle)
+        self.enpassantlog.append(self.enpassantsq)
+
+        self.zobrist = key ^ Zobrist.CASTLE_RIGHTS_KEYS[self.castle] ^ \
+            Zobrist.enpassantkey(self.board, self.enpassantsq, self.whiteToMove)
+        self.zobristlog.append(self.zobrist)
+        self.repetitions[self.zobrist] = self.repetitions.get(self.zobrist, 0) + 1
+        if move.movedPiece[1] == 'p' or move.capturedPiece != '--':
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        self.halfmovelog.append(self.halfmove)
 
 
     """
@@ -88,6 +354,7 @@ class GameState:
     def undoMove(self):
         if self.moveLog:
             move = self.moveLog.pop()
+            self.updateEval(move, -1)
             # print(move.endRow, move.endCol)
             self.board[move.endRow][move.endCol] = move.capturedPiece
             self.board[move.startRow][move.startCol] = move.movedPiece
@@ -103,13 +370,23 @@ class GameState:
             if move.isenpassant:
                 self.board[move.endRow][move.endCol] = '--'
                 self.board[move.startRow][move.endCol] = move.capturedPiece
-                self.enpassantsq = (move.endRow, move.endCol)
+            self.enpassantlog.pop()
+            self.enpassantsq = self.enpassantlog[-1]
 
             # update castle rights
-            # print(len(self.castlelog))
             self.castlelog.pop()
             self.castle = self.castlelog[-1]
 
+            count = self.repetitions[self.zobrist] - 1
+            if count:
+                self.repetitions[self.zobrist] = count
+            else:
+                del self.repetitions[self.zobrist]
+            self.zobristlog.pop()
+            self.zobrist = self.zobristlog[-1]
+            self.halfmovelog.pop()
+            self.halfmove = self.halfmovelog[-1]
+
             # undo castling
             if move.isCastle:
                 if move.endCol - move.startCol == 2:  # Kingside Castle
@@ -124,33 +401,56 @@ class GameState:
 
 
 
-    def castleRights(self, move):
-        if move.movedPiece == "wk":
-            self.castle.wks = False
-            self.castle.wkq = False
+    """
+    How many times the current position has come up in the game, this time included
+    """
 
-        elif move.movedPiece == "bk":
-            self.castle.bks = False
-            self.castle.bkq = False
+    def repetitionCount(self):
+        return self.repetitions[self.zobrist]
 
-        elif move.movedPiece == "wr":
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.castle.wqs = False
-                elif move.startCol == 7:
-                    self.castle.wks = False
-        elif move.movedPiece == "Br":
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.castle.bqs = False
-                elif move.startCol == 7:
-                    self.castle.bks = False
+    """
+    "threefold repetition" or "fifty-move rule" when the game can be called a draw, else None.
+    A checkmate on the move that reaches the fifty-move limit still wins, check gs.checkmate first.
+    """
+
+    def drawReason(self):
+        if self.repetitions[self.zobrist] >= 3:
+            return "threefold repetition"
+        if self.halfmove >= 100:
+            return "fifty-move rule"
+        return None
 
     """
-    All moves considering checks
+    A move from or to a king or rook starting square takes away the rights that need that piece:
+    the king or rook moved, or the rook was taken
     """
 
-    def getValidMoves(self):
+    def castleRights(self, move):
+        self.castle &= CASTLE_MASKS[move.startRow * 8 + move.startCol] & CASTLE_MASKS[move.endRow * 8 + move.endCol]
+
+    """
+    All moves considering checks.
+    kind="captures" only gives captures, en passant and promotions, kind="quiets" the rest,
+    the two together are all the moves. Checkmate and stalemate are only decided for kind="all".
+    """
+
+    def getValidMoves(self, kind="all"):
+        moves = self.getLegalMoves(kind)
+        if kind != "all":
+            return moves
+
+        if len(moves) == 0:
+            if self.incheck:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        else:
+            self.checkmate = False
+            self.stalemate = False
+
+        return moves
+
+    def getLegalMoves(self, kind):
         self.incheck, self.pins, self.checks = self.checkForPinsAndChecks()
         # print(self.pins)
         moves = []
@@ -163,7 +463,7 @@ class GameState:
         if self.incheck:
             # print('check')
             if len(self.checks) == 1:  # only one check to deal with
-                moves = self.getAllPossibleMoves()
+                moves = self.getAllPossibleMoves(kind)
                 check = self.checks[0]
                 crow, ccol = check[0], check[1]
                 dir = (check[2], check[3])
@@ -182,29 +482,15 @@ class GameState:
                 for i in range(len(moves) - 1, -1, -1):
                     if moves[i].movedPiece[1] != "k":
                         if not (moves[i].endRow, moves[i].endCol) in validSqs:
-                            if not moves[i].isenpassant:
-                                moves.remove(moves[i])
-                            elif not (
-                                    (self.whiteToMove and self.enpassantsq[0] + 2 == kr and self.enpassantsq[1] + 1 == kc) or
-                                    (self.whiteToMove and self.enpassantsq[0] + 2 == kr and self.enpassantsq[1] - 1 == kc) or
-                                    (not self.whiteToMove and self.enpassantsq[0] - 2 == kr and self.enpassantsq[1] + 1 == kc) or
-                                    (not self.whiteToMove and self.enpassantsq[0] - 2 == kr and self.enpassantsq[1] - 1 == kc)):
+                            # en passant also stops the check when the pawn it takes is the checking piece
+                            if not moves[i].isenpassant or (moves[i].startRow, moves[i].endCol) != (crow, ccol):
                                 moves.remove(moves[i])
 
 
             else:  # it's a double check
-                self.getKingMoves(kr, kc, moves)
+                self.getKingMoves(kr, kc, moves, kind)
         else:  # not in check
-            moves = self.getAllPossibleMoves()
-
-        if len(moves) == 0:
-            if self.incheck:
-                self.checkmate = True
-            else:
-                self.stalemate = True
-        else:
-            self.checkmate = False
-            self.stalemate = False
+            moves = self.getAllPossibleMoves(kind)
 
         return moves
 
@@ -268,169 +554,22 @@ class GameState:
                     checks.append((endrow, endcol, d[0], d[1]))
         return incheck, pins, checks
 
-    """
-    Determine if the current player is in check
-    """
-
-    def incheck(self):
-        if self.whiteToMove:
-            return self.sqUnderAttack(self.wkloc[0], self.wkloc[1])
-        else:
-            return self.sqUnderAttack(self.bkloc[0], self.bkloc[1])
-
-    def incheck2(self):
-        if self.whiteToMove:
-            king = self.wkloc
-        else:
-            king = self.bkloc
-        r, c = king[0], king[1]
-
-        # Vertical / Horizontal
-        for dr, dc in [(0, 1), (-1, 0), (0, -1), (1, 0)]:
-            n = 1
-            while 0 <= r + dr * n <= 7 and 0 <= c + dc * n <= 7:
-                newr, newc = r + dr * n, c + dc * n
-                if self.board[newr][newc] != "--":  # not an empty square
-                    if self.board[newr][newc][0] != self.board[r][c][0] and (
-                            self.board[newr][newc][1] == 'r' or
-                            self.board[newr][newc][1] == 'q'):
-                        # enemy piece + rook or queen
-                        return True
-                    break
-                else:
-                    n += 1
-
-        # Diagonal
-        for dr, dc in [(1, 1), (-1, 1), (1, -1), (-1, -1)]:
-            n = 1
-            while 0 <= r + dr * n <= 7 and 0 <= c + dc * n <= 7:
-                newr, newc = r + dr * n, c + dc * n
-                if self.board[newr][newc] != "--":  # not an empty square
-                    if self.board[newr][newc][0] != self.board[r][c][0] and (
-                            self.board[newr][newc][1] == 'b' or
-                            self.board[newr][newc][1] == 'q'):
-                        # enemy piece + bishop or queen
-                        return True
-                    break
-                else:
-                    n += 1
-
-        # Knight Check
-        for dr, dc in [(-1, -2), (-1, 2), (1, -2), (1, 2), (-2, -1), (-2, 1), (2, -1), (2, 1)]:
-            if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
-                newr, newc = r + dr, c + dc
-                if self.board[newr][newc] != "--":  # not an empty square
-                    if self.board[newr][newc][0] != self.board[r][c][0] and (
-                            self.board[newr][newc][1] == 'n'):
-                        # enemy piece + knight
-                        return True
-
-        # Pawn Check
-        if self.whiteToMove:
-            if r - 1 > -1:
-                if c - 1 >= 0:  # diagonally
-                    if self.board[r - 1][c - 1] == 'bp':  # enemy piece
-                        return True
-                if c + 1 <= 7:  # diagonally
-                    if self.board[r - 1][c + 1] == 'bp':  # enemy piece
-                        return True
-        else:
-            if r + 1 < 8:
-                if c - 1 >= 0:  # diagonally
-                    if self.board[r + 1][c - 1] == 'wp':  # enemy piece
-                        return True
-                if c + 1 <= 7:  # diagonally
-                    if self.board[r + 1][c + 1] == 'wp':  # enemy piece
-                        return True
-
-        # Kings in touch
-        for dr in range(-1, 2):
-            for dc in range(-1, 2):
-                if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
-                    newr, newc = r + dr, c + dc
-                    if self.board[newr][newc][0] != self.board[r][c][0] and (
-                            self.board[newr][newc][1] == 'k'):
-                        # enemy piece + knight
-                        return True
-
-        return False
-
-    """
-    Determine if the enemy can attack the square (r,c)
-    """
-
-    def sqUnderAttack(self, r, c):
-        # self.whiteToMove = not self.whiteToMove  # switch to opponent's pov
-        # oppMoves = self.getAllPossibleMoves()
-        # self.whiteToMove = not self.whiteToMove
-        # for m in oppMoves:
-        #     if m.endRow == r and m.endCol == c:
-        #         return True
-        # return False
-        if self.whiteToMove:
-            enm = "b"
-            aly = "w"
-        else:
-            enm = "w"
-            aly = "b"
-        strow = r
-        stcol = c
-
-        dirs = [(1, 0), (0, 1), (-1, 0), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]  # rook and bishop dirs
-        for j in range(len(dirs)):
-            d = dirs[j]
-            for i in range(1, 8):
-                endrow = strow + d[0] * i
-                endcol = stcol + d[1] * i
-                if 0 <= endrow <= 7 and 0 <= endcol <= 7:  # not out of board
-                    piece = self.board[endrow][endcol]
-                    if piece[0] == aly and piece[1] != "k":  # ally piece
-                        break
-
-                    elif piece[0] == enm:  # enemy piece
-                        type = piece[1]
-                        if (0 <= j <= 3 and type == "r") or \
-                                (4 <= j <= 7 and type == "b") or \
-                                (i == 1 and type == "p" and (
-                                        (enm == "w" and 4 <= j <= 5) or (enm == "b" and 6 <= j <= 7))) or \
-                                (type == "q") or \
-                                (i == 1 and type == "k"):  # check if the enemy piece is attacking
-                            return True
-                        else:  # the enemy piece is not attacking
-                            break
-                else:  # out of board, no need to continue
-                    break
-
-        knightDirs = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
-        for d in knightDirs:
-            endrow = strow + d[0]
-            endcol = stcol + d[1]
-            if 0 <= endrow <= 7 and 0 <= endcol <= 7:  # not out of board
-                piece = self.board[endrow][endcol]
-                if piece[0] == enm and piece[1] == "n":
-                    return True
-        return False
-
     """
     All moves without considering checks
     """
 
-    def getAllPossibleMoves(self):
+    def getAllPossibleMoves(self, kind="all"):
         moves = []
         for r in range(8):
             for c in range(8):
                 turn = self.board[r][c][0]
                 if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
                     piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)
+                    self.moveFunctions[piece](r, c, moves, kind)
 
         return moves
 
-    def getPawnMoves(self, r, c, moves):
-        if self.moveLog:
-            if self.moveLog[-1].movedPiece[1] == "p" and abs(self.moveLog[-1].startRow - self.moveLog[-1].endRow) == 2:
-                self.enpassantsq = (
-                (self.moveLog[-1].startRow + self.moveLog[-1].endRow) // 2, self.moveLog[-1].startCol)
+    def getPawnMoves(self, r, c, moves, kind="all"):
         pinned = False
         dir = ()
         for p in self.pins:
@@ -442,46 +581,78 @@ class GameState:
         if self.whiteToMove:
             if r - 1 > -1:
                 if self.board[r - 1][c] == "--":  # move forward 1 square
-                    if not pinned or dir == (-1, 0):
-                        moves.append(Move((r, c), (r - 1, c), self.board))
-                        if r == 6 and self.board[r - 2][c] == "--":  # move forward 2 squares
+                    if not pinned or dir[1] == 0:  # pinned along the file, either way round
+                        if kind == "all" or (kind == "captures") == (r - 1 == 0):  # promotions count as captures
+                            self.addPawnMove((r, c), (r - 1, c), moves)
+                        if r == 6 and self.board[r - 2][c] == "--" and kind != "captures":  # move forward 2 squares
                             moves.append(Move((r, c), (r - 2, c), self.board))
 
-                if c - 1 >= 0:  # take diagonally / left
+                if c - 1 >= 0 and kind != "quiets":  # take diagonally / left
                     if not pinned or dir == (-1, -1):
                         if self.board[r - 1][c - 1][0] == 'b':  # enemy piece
-                            moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                        if (r - 1, c - 1) == self.enpassantsq:
-                            # print('lol')
+                            self.addPawnMove((r, c), (r - 1, c - 1), moves)
+                        if (r - 1, c - 1) == self.enpassantsq and not self.enpassantPinned(r, c, c - 1):
                             moves.append(Move((r, c), (r - 1, c - 1), self.board, True))
-                if c + 1 <= 7:  # take diagonally / right
+                if c + 1 <= 7 and kind != "quiets":  # take diagonally / right
                     if not pinned or dir == (-1, 1):
                         if self.board[r - 1][c + 1][0] == 'b':  # enemy piece
-                            moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                        if (r - 1, c + 1) == self.enpassantsq:
+                            self.addPawnMove((r, c), (r - 1, c + 1), moves)
+                        if (r - 1, c + 1) == self.enpassantsq and not self.enpassantPinned(r, c, c + 1):
                             moves.append(Move((r, c), (r - 1, c + 1), self.board, True))
         else:
             if r + 1 < 8:
                 if self.board[r + 1][c] == "--":  # move forward 1 square
-                    if not pinned or dir == (1, 0):
-                        moves.append(Move((r, c), (r + 1, c), self.board))
-                        if r == 1 and self.board[r + 2][c] == "--":  # move forward 2 squares
+                    if not pinned or dir[1] == 0:
+                        if kind == "all" or (kind == "captures") == (r + 1 == 7):  # promotions count as captures
+                            self.addPawnMove((r, c), (r + 1, c), moves)
+                        if r == 1 and self.board[r + 2][c] == "--" and kind != "captures":  # move forward 2 squares
                             moves.append(Move((r, c), (r + 2, c), self.board))
 
-                if c - 1 >= 0:  # take diagonally / left
+                if c - 1 >= 0 and kind != "quiets":  # take diagonally / left
                     if not pinned or dir == (1, -1):
                         if self.board[r + 1][c - 1][0] == 'w':  # enemy piece
-                            moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                        if (r + 1, c - 1) == self.enpassantsq:
+                            self.addPawnMove((r, c), (r + 1, c - 1), moves)
+                        if (r + 1, c - 1) == self.enpassantsq and not self.enpassantPinned(r, c, c - 1):
                             moves.append(Move((r, c), (r + 1, c - 1), self.board, True))
-                if c + 1 <= 7:  # take diagonally / right
+                if c + 1 <= 7 and kind != "quiets":  # take diagonally / right
                     if not pinned or dir == (1, 1):
                         if self.board[r + 1][c + 1][0] == 'w':  # enemy piece
-                            moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                        if (r + 1, c + 1) == self.enpassantsq:
+                            self.addPawnMove((r, c), (r + 1, c + 1), moves)
+                        if (r + 1, c + 1) == self.enpassantsq and not self.enpassantPinned(r, c, c + 1):
                             moves.append(Move((r, c), (r + 1, c + 1), self.board, True))
 
-    def getRookMoves(self, r, c, moves):
+    """
+    Adds a pawn move, a move to the last rank once for each piece the pawn can become
+    """
+
+    def addPawnMove(self, start, end, moves):
+        if end[0] == 0 or end[0] == 7:
+            for piece in Move.promotionPieces:
+                moves.append(Move(start, end, self.board, promotionChoice=piece))
+        else:
+            moves.append(Move(start, end, self.board))
+
+    """
+    True if taking en passant from (r, c) to column epcol would leave the king in check along the rank,
+    both pawns leave the rank at once so the pins search can't see it
+    """
+
+    def enpassantPinned(self, r, c, epcol):
+        kr, kc = self.wkloc if self.whiteToMove else self.bkloc
+        if kr != r:
+            return False
+        enm = "b" if self.whiteToMove else "w"
+        step = 1 if c > kc else -1
+        col = kc + step
+        while 0 <= col <= 7:
+            if col != c and col != epcol:
+                piece = self.board[r][col]
+                if piece != "--":
+                    return piece[0] == enm and (piece[1] == "r" or piece[1] == "q")
+            col += step
+        return False
+
+    def getRookMoves(self, r, c, moves, kind="all"):
         pinned = False
         dir = ()
         for p in self.pins:
@@ -496,14 +667,15 @@ class GameState:
                 while 0 <= r + dr * n <= 7 and 0 <= c + dc * n <= 7:
                     newr, newc = r + dr * n, c + dc * n
                     if self.board[newr][newc] == "--":
-                        moves.append(Move((r, c), (newr, newc), self.board))
+                        if kind != "captures":
+                            moves.append(Move((r, c), (newr, newc), self.board))
                         n += 1
                     else:
-                        if self.board[newr][newc][0] != self.board[r][c][0]:
+                        if self.board[newr][newc][0] != self.board[r][c][0] and kind != "quiets":
                             moves.append(Move((r, c), (newr, newc), self.board))
                         break
 
-    def getKnightMoves(self, r, c, moves):
+    def getKnightMoves(self, r, c, moves, kind="all"):
         for p in self.pins:
             if p[0] == r and p[1] == c:
                 return
@@ -511,9 +683,10 @@ class GameState:
             if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
                 newr, newc = r + dr, c + dc
                 if self.board[newr][newc][0] != self.board[r][c][0]:
-                    moves.append(Move((r, c), (newr, newc), self.board))
+                    if kind == "all" or (kind == "captures") == (self.board[newr][newc] != "--"):
+                        moves.append(Move((r, c), (newr, newc), self.board))
 
-    def getBishopMoves(self, r, c, moves):
+    def getBishopMoves(self, r, c, moves, kind="all"):
         pinned = False
         dir = ()
         for p in self.pins:
@@ -528,91 +701,170 @@ class GameState:
                 while 0 <= r + dr * n <= 7 and 0 <= c + dc * n <= 7:
                     newr, newc = r + dr * n, c + dc * n
                     if self.board[newr][newc] == "--":
-                        moves.append(Move((r, c), (newr, newc), self.board))
+                        if kind != "captures":
+                            moves.append(Move((r, c), (newr, newc), self.board))
                         n += 1
                     else:
-                        if self.board[newr][newc][0] != self.board[r][c][0]:
+                        if self.board[newr][newc][0] != self.board[r][c][0] and kind != "quiets":
                             moves.append(Move((r, c), (newr, newc), self.board))
                         break
 
-    def getQueenMoves(self, r, c, moves):
-        self.getBishopMoves(r, c, moves)
-        self.getRookMoves(r, c, moves)
+    def getQueenMoves(self, r, c, moves, kind="all"):
+        self.getBishopMoves(r, c, moves, kind)
+        self.getRookMoves(r, c, moves, kind)
 
-    def getKingMoves(self, r, c, moves):
+    def getKingMoves(self, r, c, moves, kind="all"):
         aly = "w" if self.whiteToMove else "b"
-        for dr in range(-1, 2):
-            for dc in range(-1, 2):
-                if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
-                    newr, newc = r + dr, c + dc
-                    endsq = self.board[newr][newc]
-                    if endsq[0] != aly:
-                        if aly == "w":
-                            self.wkloc = (newr, newc)
-                        else:
-                            self.bkloc = (newr, newc)
-                        incheck, pins, checks = self.checkForPinsAndChecks()
-                        if not incheck:
-                            moves.append(Move((r, c), (newr, newc), self.board))
-                        if aly == "w":
-                            self.wkloc = (r, c)
-                        else:
-                            self.bkloc = (r, c)
-        self.getCastleMoves(r, c, moves, aly)
-
-    def getCastleMoves(self, r, c, moves, aly):
-        if self.incheck2() or not ((r, c) == (7, 4) if self.whiteToMove else (r, c) == (0, 4)):
+        board = self.board
+        attacked = None  # only worked out once the king has somewhere to go
+        for sq in KING_TARGETS[r * 8 + c]:
+            newr, newc = sq >> 3, sq & 7
+            endsq = board[newr][newc]
+            if endsq[0] != aly and (kind == "all" or (kind == "captures") == (endsq != "--")):
+                if attacked is None:
+                    attacked = self.getAttackMap()
+                if not attacked[sq]:
+                    moves.append(Move((r, c), (newr, newc), board))
+        if kind != "captures":
+            self.getCastleMoves(r, c, moves, aly, attacked)
+
+    """
+    The squares the enemy attacks, a list of 64 bools by r * 8 + c.
+    The king of the side to move is taken off the board first, so a square behind it on the
+    line of a checking slider counts as attacked and the king can't step back along the check.
+    """
+
+    def getAttackMap(self):
+        enm = "b" if self.whiteToMove else "w"
+        kr, kc = self.wkloc if self.whiteToMove else self.bkloc
+        board = self.board
+        board[kr][kc] = '--'
+        attacked = [False] * 64
+        forward = 1 if enm == "b" else -1
+        for r in range(8):
+            row = board[r]
+            for c in range(8):
+                piece = row[c]
+                if piece[0] != enm:
+                    continue
+                type = piece[1]
+                if type == "p":
+                    pr = r + forward
+                    if 0 <= pr <= 7:
+                        if c > 0:
+                            attacked[pr * 8 + c - 1] = True
+                        if c < 7:
+                            attacked[pr * 8 + c + 1] = True
+                elif type == "n":
+                    for sq in KNIGHT_TARGETS[r * 8 + c]:
+                        attacked[sq] = True
+                elif type == "k":
+                    for sq in KING_TARGETS[r * 8 + c]:
+                        attacked[sq] = True
+                else:
+                    for dr, dc in SLIDER_DIRS[type]:
+                        newr, newc = r + dr, c + dc
+                        while 0 <= newr <= 7 and 0 <= newc <= 7:
+                            attacked[newr * 8 + newc] = True
+                            if board[newr][newc] != "--":
+                                break
+                            newr += dr
+                            newc += dc
+        board[kr][kc] = "wk" if self.whiteToMove else "bk"
+        return attacked
+
+    def getCastleMoves(self, r, c, moves, aly, attacked=None):
+        # getLegalMoves has just worked out if the king is in check
+        if self.incheck or not ((r, c) == (7, 4) if self.whiteToMove else (r, c) == (0, 4)):
             return
 
-        if (self.whiteToMove and self.castle.wks) or (not self.whiteToMove and self.castle.bks):
-            self.kscastle(r, c, moves, aly)
+        if self.castle & (WKS if self.whiteToMove else BKS):
+            attacked = self.kscastle(r, c, moves, aly, attacked)
 
-        if (self.whiteToMove and self.castle.wqs) or (not self.whiteToMove and self.castle.wqs):
-            self.qscastle(r, c, moves, aly)
+        if self.castle & (WQS if self.whiteToMove else BQS):
+            self.qscastle(r, c, moves, aly, attacked)
+
+    """
+    kscastle and qscastle return the attack map, made here if it wasn't yet and the path is clear
+    """
 
-    def kscastle(self, r, c, moves, aly):
+    def kscastle(self, r, c, moves, aly, attacked=None):
         if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--':
-            if not self.sqUnderAttack(r, c + 1) and not self.sqUnderAttack(r, c + 2):
+            if attacked is None:
+                attacked = self.getAttackMap()
+            if not attacked[r * 8 + c + 1] and not attacked[r * 8 + c + 2]:
                 moves.append(Move((r, c), (r, c + 2), self.board, castle=True))
+        return attacked
 
-    def qscastle(self, r, c, moves, aly):
+    def qscastle(self, r, c, moves, aly, attacked=None):
         if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
-            if not self.sqUnderAttack(r, c - 1) and not self.sqUnderAttack(r, c - 2):
+            if attacked is None:
+                attacked = self.getAttackMap()
+            if not attacked[r * 8 + c - 1] and not attacked[r * 8 + c - 2]:
                 moves.append(Move((r, c), (r, c - 2), self.board, castle=True))
+        return attacked
 
 
-class CastleRights:
-    def __init__(self, wks, wqs, bks, bqs):
-        self.wks = wks
-        self.wqs = wqs
-        self.bks = bks
-        self.bqs = bqs
+"""
+The eight squares of a FEN row as a tuple, or None if the row isn't valid.
+Cached: the same rows come up over and over in a big FEN file, and the cache is bounded so it can't grow with it.
+"""
+
+
+@lru_cache(maxsize=4096)
+def parseFenRow(row):
+    squares = []
+    for ch in row:
+        if ch in "12345678":
+            squares.extend(['--'] * int(ch))
+        elif ch in "pnbrqkPNBRQK":
+            squares.append(("w" if ch.isupper() else "b") + ch.lower())
+        else:
+            return None
+    if len(squares) != 8:
+        return None
+    return tuple(squares)
 
 
 class Move:
+    # slots instead of a __dict__, a Move is made for every move generated at every node
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "movedPiece", "capturedPiece", "moveID",
+                 "isPawnPromotion", "promotionChoice", "isenpassant", "isCastle")
+
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
 
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isenpassant=False, castle=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.movedPiece = board[self.startRow][self.startCol]
-        self.capturedPiece = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+    promotionPieces = "qrbn"
+
+    """
+    moveID packs the move in 15 bits: start square (r * 8 + c) in bits 0-5, end square in bits 6-11 and
+    the promotion piece (index in promotionPieces, 0 for a queen or no promotion) in bits 12-14
+    """
+
+    def __init__(self, startSq, endSq, board, isenpassant=False, castle=False, promotionChoice="q"):
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        self.movedPiece = movedPiece = board[startRow][startCol]
+        self.capturedPiece = board[endRow][endCol]
+        self.moveID = startRow * 8 + startCol | (endRow * 8 + endCol) << 6
 
         # Pawn promption
-        self.isPawnPromotion = (self.movedPiece == "wp" and self.endRow == 0) or (
-                self.movedPiece == "bp" and self.endRow == 7)
+        self.isPawnPromotion = (endRow == 0 or endRow == 7) and movedPiece[1] == "p"
+        self.promotionChoice = promotionChoice
+        if promotionChoice != "q" and self.isPawnPromotion:
+            self.moveID |= self.promotionPieces.index(promotionChoice) << 12
 
         # En Passant
         self.isenpassant = isenpassant
-        if self.isenpassant:
-            self.capturedPiece = "wp" if self.movedPiece == "bp" else "bp"
+        if isenpassant:
+            self.capturedPiece = "wp" if movedPiece == "bp" else "bp"
 
         # Castle
         self.isCastle = castle
@@ -624,28 +876,32 @@ class Move:
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
         piece = self.movedPiece[1]
         if "p" in piece:
             return self.getRankFile(self.endRow, self.endCol)
         return self.movedPiece[1].capitalize() + self.getRankFile(self.endRow, self.endCol)
 
+    """
+    Long algebraic notation as UCI uses it, e.g. e2e4 or a7a8n
+    """
+
+    def getUciNotation(self):
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionChoice
+        return notation
+
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
 
 if __name__ == '__main__':
-    gs = GameState()
-    gs.board = [
-        ['br', 'bn', 'bb', 'bq', 'bk', 'bb', 'bn', 'br'],
-        ['bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'],
-        ['--', '--', '--', '--', '--', '--', '--', '--'],
-        ['--', '--', '--', '--', '--', '--', '--', '--'],
-        ['--', '--', '--', '--', '--', '--', '--', '--'],
-        ['--', '--', '--', '--', '--', '--', '--', '--'],
-        ['wp', 'wp', 'wp', 'wp', 'br', 'wp', 'wp', 'wp'],
-        ['wr', 'wn', 'wb', 'wq', 'wk', 'wb', 'wn', 'wr']]
-
-    # vals = [m.getChessNotation() for m in gs.getAllValidMoves()]
-    # print(vals)
-    # print(gs.isCheck())
+    # a black rook giving check on e2
+    gs = GameState.from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPrPPP/RNBQKBNR w KQkq - 0 1")
+    vals = [m.getChessNotation() for m in gs.getValidMoves()]
+    print(vals)
+    print(gs.to_fen())
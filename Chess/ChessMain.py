@@ -9,9 +9,12 @@ responsible for
 
 """ checks, checkmate and stalemate are now working fine (part 7) """
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
 import pygame as p
 
-from Chess import ChessEngine
+from Chess import ChessEngine, PgnIO
+import SmartMoveFinder
 from SmartMoveFinder import *
 import time
 
@@ -20,6 +23,12 @@ DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+COLORS = [p.Color("white"), p.Color("grey")]
+BOARD = None  # pre-rendered empty board
+HIGHLIGHTS = {}
+TEXTS = {}  # rendered text by string
+drawnSqs = {}  # what is on screen for each square, (piece, highlight, overlays over it)
+dirtyRects = []  # parts of the screen changed since the last p.display.update()
 
 """
 Initialize a global dictionary of images2. 
@@ -47,11 +56,17 @@ def main():
     moveMade = False  # when a move is made
     doanim = False
     loadImages()  # only do this once, b4 the while loop
+    loadBoard()
+    drawnSqs.clear()
     running = True
     selectedSq = ()
     over = False
     pl1 = False  # True if human is playing white else False
     pl2 = False  # Vice versa
+    # the AI searches on a worker thread so the window keeps handling events while it thinks
+    worker = ThreadPoolExecutor(max_workers=1)
+    aifuture = None
+    thinkstart = 0
 
     while running:
         humanTurn = (gs.whiteToMove and pl1) or (not gs.whiteToMove and pl2)
@@ -59,6 +74,8 @@ def main():
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.WINDOWEXPOSED:
+                drawnSqs.clear()  # draw everything again
             # handling the human turn
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not over and humanTurn:
@@ -72,9 +89,10 @@ def main():
                             #  make the move.
                             move = ChessEngine.Move(selectedSq, (row, col), gs.board)
                             if move == validMoves[i]:
+                                san = PgnIO.movesan(gs, validMoves[i], validMoves)
                                 gs.makeMove(validMoves[i])
-                                print("Player goes:",move.getChessNotation())
-                                # print(f'Castle rights: wks:{gs.castle.wks} / wqs:{gs.castle.wqs} / bks:{gs.castle.bks} / bqs:{gs.castle.bqs}')
+                                print("Player goes:", san)
+                                # print('Castle rights:', gs.to_fen().split()[2])
                                 # print_board(gs.board)
                                 print('-----------------------------------------------------------------')
                                 moveMade = True
@@ -90,11 +108,13 @@ def main():
             # undoing a move
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_LEFT:
+                    aifuture = cancelsearch(aifuture)
                     gs.undoMove()
                     moveMade = True
                     doanim = False
 
                 if e.key == p.K_r:
+                    aifuture = cancelsearch(aifuture)
                     gs = ChessEngine.GameState()
                     validMoves = gs.getValidMoves()
                     selectedSq = ()
@@ -102,16 +122,23 @@ def main():
                     doanim = False
 
         # AI moves
-        if not over and not humanTurn:
-            AImove = findbestmove(gs, validMoves)
-            # AImove = None
+        if not over and not humanTurn and not moveMade and aifuture is None:
+            # searched on a copy, gs stays free for drawing, undo and reset
+            aifuture = worker.submit(searchcopy, gs.copy())
+            thinkstart = time.time()
+
+        if aifuture is not None and aifuture.done():
+            AImove = aifuture.result()
+            aifuture = None
+            # the copy's move, played as the same move from validMoves
+            AImove = next((move for move in validMoves if move == AImove), None)
             if AImove is None:
                 AImove = randmove(validMoves)
                 print("Randomized!!!!!!!!!!!")
+            san = PgnIO.movesan(gs, AImove, validMoves)
             gs.makeMove(AImove)
-            print("Compy goes:",AImove.getChessNotation())
-            # print(
-            #     f'Castle rights: wks:{gs.castle.wks} / wqs:{gs.castle.wqs} / bks:{gs.castle.bks} / bqs:{gs.castle.bqs}')
+            print("Compy goes:", san)
+            # print('Castle rights:', gs.to_fen().split()[2])
 
             # print_board(gs.board)
             print('---------')
@@ -124,123 +151,204 @@ def main():
             validMoves = gs.getValidMoves()
             moveMade = False
 
-        #  update the board.
-        drawGameState(screen, gs, validMoves, selectedSq)
+        overlays = []
         # time.sleep(0.3)
         if gs.checkmate:
             over = True
             if gs.whiteToMove:
-                drawtext(screen, 'Black wins by Checkmate!')
+                overlays += drawtext('Black wins by Checkmate!')
             else:
-                drawtext(screen, 'White wins by Checkmate!')
+                overlays += drawtext('White wins by Checkmate!')
 
         elif gs.stalemate:
             over = True
-            drawtext(screen, 'Stalemate')
+            overlays += drawtext('Stalemate')
+
+        elif gs.drawReason() is not None:
+            over = True
+            overlays += drawtext('Draw by ' + gs.drawReason())
 
         else:
             over = False
 
+        if aifuture is not None:
+            overlays += drawthinking(time.time() - thinkstart)
+
+        #  update the board.
+        drawGameState(screen, gs, validMoves, selectedSq, overlays)
         clock.tick(MAX_FPS)
-        p.display.flip()
+        p.display.update(dirtyRects)
+        dirtyRects.clear()
+
+    cancelsearch(aifuture)
+    worker.shutdown()
 
 
 """
-Highlight the square selected and possible moves for the selected piece
+Runs on the worker thread: the AI's move for a copy of the game
 """
 
 
-def hightlightSqs(screen, gs, validmoves, selectedSq):
-    if selectedSq:
-        r, c = selectedSq
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            # hightlight selectedSq
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-            # highligh possible moves for the selected piece
-            s.fill(p.Color('yellow'))
-            for m in validmoves:
-                if m.startRow == r and m.startCol == c:
-                    screen.blit(s, (SQ_SIZE * m.endCol, SQ_SIZE * m.endRow))
+def searchcopy(gs):
+    return findbestmove(gs, gs.getValidMoves())
 
 
 """
-Responsible for all the graphics within the current game state
+Stops a running AI search and waits for the worker to finish it, returns None to clear the future
 """
 
 
-def drawGameState(screen, gs, validmoves, selectedSq):
-    drawBoard(screen)
-    hightlightSqs(screen, gs, validmoves, selectedSq)
-    drawPieces(screen, gs.board)
+def cancelsearch(future):
+    while future is not None and not future.done():
+        # findbestmove clears the flag when it starts, so keep setting it until the search is over
+        SmartMoveFinder.stopsearch = True
+        try:
+            future.result(0.01)
+        except TimeoutError:
+            pass
+    return None
 
 
 """
-Draws the squares on the board.
+Draws the empty board once, squares are copied from it when they change. Also the highlight surfaces.
 """
 
 
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color("grey")]
-    for x in range(DIMENSION):
-        for y in range(DIMENSION):
-            color = colors[(x + y) % 2]
-            p.draw.rect(screen, color, p.Rect(x * SQ_SIZE, y * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+def loadBoard():
+    global BOARD, HIGHLIGHTS
+    BOARD = p.Surface((WIDTH, HEIGHT))
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            BOARD.fill(COLORS[(r + c) % 2], squareRect(r, c))
+    HIGHLIGHTS = {}
+    for kind, color in (("selected", "blue"), ("move", "yellow")):
+        s = p.Surface((SQ_SIZE, SQ_SIZE))
+        s.set_alpha(100)
+        s.fill(p.Color(color))
+        HIGHLIGHTS[kind] = s
+
+
+def squareRect(r, c):
+    return p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
 
 
 """
-Draw the pieces on the board according to the current GameState.Board.
+Highlights for the square selected and possible moves for the selected piece, by square
 """
 
 
-def drawPieces(screen, board):
-    for r in range(8):
-        for c in range(8):
-            rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-            piece = board[r][c]
-            if piece != '--':
-                img = IMAGES[piece]
-                screen.blit(img, rect)
+def highlights(gs, validmoves, selectedSq):
+    marks = {}
+    if selectedSq:
+        r, c = selectedSq
+        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
+            for m in validmoves:
+                if m.startRow == r and m.startCol == c:
+                    marks[(m.endRow, m.endCol)] = "move"
+            marks[(r, c)] = "selected"
+    return marks
 
 
 """
-Animations!
+Responsible for all the graphics within the current game state.
+Only the squares whose piece, highlight or overlapping text changed since the last frame are drawn again, their rects
+are collected in dirtyRects for p.display.update(). overlays are (surface, position) pairs drawn over the board.
+"""
+
+
+def drawGameState(screen, gs, validmoves, selectedSq, overlays=()):
+    marks = highlights(gs, validmoves, selectedSq)
+    overlayRects = [surface.get_rect(topleft=pos) for surface, pos in overlays]
+    redrawn = []
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            rect = squareRect(r, c)
+            covered = tuple(i for i, orect in enumerate(overlayRects) if orect.colliderect(rect))
+            state = (gs.board[r][c], marks.get((r, c)), tuple(overlays[i][0] for i in covered))
+            if drawnSqs.get((r, c)) != state:
+                drawSquare(screen, r, c, gs.board[r][c], marks.get((r, c)))
+                drawnSqs[(r, c)] = state
+                redrawn.append(rect)
+                dirtyRects.append(rect)
+    # text goes back over any square drawn under it, all of it in order so overlapping texts stack the same way
+    if any(orect.collidelist(redrawn) != -1 for orect in overlayRects):
+        for surface, pos in overlays:
+            screen.blit(surface, pos)
+
+
+def drawSquare(screen, r, c, piece, mark=None):
+    rect = squareRect(r, c)
+    screen.blit(BOARD, rect, rect)
+    if mark is not None:
+        screen.blit(HIGHLIGHTS[mark], rect)
+    if piece != '--':
+        screen.blit(IMAGES[piece], rect)
+
+
+"""
+Animations! Each frame only restores the squares under the piece's last and next position.
 """
 
 
 def animate(move, screen, board, clock):
-    global colors
     dr = move.endRow - move.startRow
     dc = move.endCol - move.startCol
     fps = 5  # frame per square
     framecount = (abs(dr) + abs(dc)) * fps
+    # the end square shows what was there until the piece arrives
+    endpiece = move.capturedPiece if not move.isenpassant else '--'
+    # the other squares the move changed (start square, castling rook, pawn taken en passant) are drawn right away
+    changed = []
+    for (row, col), state in list(drawnSqs.items()):
+        if state[0] != board[row][col] and (row, col) != (move.endRow, move.endCol):
+            drawSquare(screen, row, col, board[row][col])
+            del drawnSqs[(row, col)]
+            changed.append(squareRect(row, col))
+    p.display.update(changed)
+    last = squareRect(move.startRow, move.startCol)
     for f in range(framecount + 1):
         r, c = (move.startRow + dr * f / framecount, move.startCol + dc * f / framecount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the moved piece from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endsq = p.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endsq)
-        # blit the captured piece into the rectangle
-        if move.capturedPiece != '--':
-            screen.blit(IMAGES[move.capturedPiece], endsq)
+        sprite = p.Rect(round(c * SQ_SIZE), round(r * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        area = last.union(sprite)
+        for row in range(area.top // SQ_SIZE, (area.bottom - 1) // SQ_SIZE + 1):
+            for col in range(area.left // SQ_SIZE, (area.right - 1) // SQ_SIZE + 1):
+                piece = endpiece if (row, col) == (move.endRow, move.endCol) else board[row][col]
+                drawSquare(screen, row, col, piece)
+                drawnSqs.pop((row, col), None)  # drawGameState puts it right after the animation
         # draw the moving piece
-        screen.blit(IMAGES[move.movedPiece], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
+        screen.blit(IMAGES[move.movedPiece], sprite)
+        p.display.update(area)
+        last = sprite
         clock.tick(90)
 
 
-def drawtext(screen, txt):
-    font = p.font.SysFont("Calibri", 32, True, False)
-    txtobj = font.render(txt, 0, p.Color('Grey'))
-    txtloc = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH / 2 - txtobj.get_width() / 2, HEIGHT / 2 - txtobj.get_height() / 2)
-    screen.blit(txtobj, txtloc)
-    txtobj = font.render(txt, 0, p.Color('Black'))
-    screen.blit(txtobj, txtloc.move(2, 2))
+"""
+Big centered text, returned as overlays for drawGameState
+"""
+
+
+def drawtext(txt):
+    if txt not in TEXTS:
+        font = p.font.SysFont("Calibri", 32, True, False)
+        txtobj = font.render(txt, 0, p.Color('Grey'))
+        txtloc = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH / 2 - txtobj.get_width() / 2,
+                                                  HEIGHT / 2 - txtobj.get_height() / 2)
+        TEXTS[txt] = [(txtobj, txtloc.topleft), (font.render(txt, 0, p.Color('Black')), txtloc.move(2, 2).topleft)]
+    return TEXTS[txt]
+
+
+"""
+Thinking indicator in the bottom left corner while the AI searches
+"""
+
+
+def drawthinking(elapsed):
+    txt = "Thinking" + "." * (int(elapsed * 2) % 4)
+    if txt not in TEXTS:
+        font = p.font.SysFont("Calibri", 20, True, False)
+        txtobj = font.render(txt, 0, p.Color('Black'))
+        TEXTS[txt] = [(txtobj, (4, HEIGHT - txtobj.get_height() - 4))]
+    return TEXTS[txt]
 
 
 def print_board(board):
@@ -127,11 +127,11 @@ class GameState:
     def castleRights(self, move):
         if move.movedPiece == "wk":
             self.castle.wks = False
-            self.castle.wkq = False
+            self.castle.wqs = False
 
         elif move.movedPiece == "bk":
             self.castle.bks = False
-            self.castle.bkq = False
+            self.castle.bqs = False
 
         elif move.movedPiece == "wr":
             if move.startRow == 7:
@@ -139,7 +139,7 @@ class GameState:
                     self.castle.wqs = False
                 elif move.startCol == 7:
                     self.castle.wks = False
-        elif move.movedPiece == "Br":
+        elif move.movedPiece == "br":
             if move.startRow == 0:
                 if move.startCol == 0:
                     self.castle.bqs = False
@@ -567,7 +567,7 @@ class GameState:
         if (self.whiteToMove and self.castle.wks) or (not self.whiteToMove and self.castle.bks):
             self.kscastle(r, c, moves, aly)
 
-        if (self.whiteToMove and self.castle.wqs) or (not self.whiteToMove and self.castle.wqs):
+        if (self.whiteToMove and self.castle.wqs) or (not self.whiteToMove and self.castle.bqs):
             self.qscastle(r, c, moves, aly)
 
     def kscastle(self, r, c, moves, aly):
@@ -0,0 +1,80 @@
+"""
+Tapered evaluation: piece values and piece-square tables for the midgame and the endgame,
+read from a data file (pst.json next to this module by default).
+GameState keeps running midgame and endgame totals for each side plus the game phase
+(see GameState.updateEval), the score is the two totals mixed by the phase.
+"""
+
+import json
+import os
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pst.json")
+PIECES = ['wp', 'wn', 'wb', 'wr', 'wq', 'wk', 'bp', 'bn', 'bb', 'br', 'bq', 'bk']
+
+# offset of each colored piece in the flat tables, the entry for a square r * 8 + c is at PIECE_INDEX[piece] + r * 8 + c
+PIECE_INDEX = {piece: i * 64 for i, piece in enumerate(PIECES)}
+
+# filled by load(), updated in place so modules holding a reference see a reload
+pieceValues = {}  # midgame values, used for material counts and pruning margins
+endgameValues = {}
+phaseWeights = {}
+mgTable = []  # piece value + piece-square bonus, midgame
+egTable = []  # piece value + piece-square bonus, endgame
+MAX_PHASE = 24  # phase with all the pieces on the board, recomputed by load()
+version = 0  # goes up with every load(), for caches built from the tables
+
+
+"""
+Reads piece values, tables and phase weights from a json file into the flat tables
+Positions already set up need GameState.loadEval() afterwards
+"""
+
+
+def load(path=DATA_FILE):
+    global MAX_PHASE, version
+    with open(path) as f:
+        data = json.load(f)
+    mg = flatten(data["midgame"])
+    eg = flatten(data["endgame"])
+    mgTable[:] = mg
+    egTable[:] = eg
+    pieceValues.clear()
+    pieceValues.update(data["midgame"]["values"])
+    endgameValues.clear()
+    endgameValues.update(data["endgame"]["values"])
+    phaseWeights.clear()
+    phaseWeights.update(data["phase"])
+    weights = phaseWeights
+    MAX_PHASE = 2 * (8 * weights["p"] + 2 * weights["n"] + 2 * weights["b"] + 2 * weights["r"] + weights["q"])
+    version += 1
+
+
+"""
+Turns one phase of the data file into a flat list of 12 * 64 values, black's tables are the white ones flipped top to bottom
+"""
+
+
+def flatten(phase):
+    table = []
+    for piece in PIECES:
+        rows = phase["tables"][piece[1]]
+        if piece[0] == 'b':
+            rows = rows[::-1]
+        value = phase["values"][piece[1]]
+        for row in rows:
+            table.extend(value + bonus for bonus in row)
+    return table
+
+
+"""
+Mixes midgame and endgame scores by the phase, all the pieces on the board is pure midgame
+"""
+
+
+def taper(mg, eg, phase):
+    if phase > MAX_PHASE:  # promotions
+        phase = MAX_PHASE
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+load()
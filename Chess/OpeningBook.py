@@ -0,0 +1,182 @@
+"""
+Polyglot opening books (.bin).
+A book is a sorted array of 16 byte big-endian entries: Zobrist key (8), move (2), weight (2), learn (4).
+The file is memory-mapped and binary-searched on GameState.zobrist (the keys are Polyglot's, see Zobrist),
+so a lookup reads a handful of entries straight from the page cache and processes share the pages.
+
+    python -m Chess.OpeningBook build games.pgn [more.pgn ...] -o book.bin [--plies 20]
+    python -m Chess.OpeningBook probe book.bin ["<fen>"]
+"""
+
+import argparse
+import mmap
+import os
+import random
+import struct
+
+from Chess import BitboardEngine, PgnIO
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+PROMOTIONS = " nbrq"  # polyglot promotion codes 1-4
+
+
+"""
+Polyglot code of a move: to file, to rank, from file, from rank (3 bits each, a1 is 0) and promotion piece,
+castling is written as the king taking its own rook
+"""
+
+
+def encodemove(move):
+    toCol = move.endCol
+    if move.isCastle:
+        toCol = 7 if move.endCol > move.startCol else 0
+    code = toCol | (7 - move.endRow) << 3 | move.startCol << 6 | (7 - move.startRow) << 9
+    if move.isPawnPromotion:
+        code |= PROMOTIONS.index(move.promotionChoice) << 12
+    return code
+
+
+def uci(code):
+    files = "abcdefgh"
+    text = files[code >> 6 & 7] + str((code >> 9 & 7) + 1) + files[code & 7] + str((code >> 3 & 7) + 1)
+    if code >> 12 & 7:
+        text += PROMOTIONS[code >> 12 & 7]
+    return text
+
+
+class OpeningBook:
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.size = size // ENTRY.size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if self.size:
+            self.map.close()
+        self.file.close()
+
+    """
+    (move code, weight) of every entry for the key, in file order
+    """
+
+    def entries(self, key):
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(self.map, mid * ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.size:
+            entrykey, move, weight, learn = ENTRY.unpack_from(self.map, lo * ENTRY.size)
+            if entrykey != key:
+                break
+            found.append((move, weight))
+            lo += 1
+        return found
+
+    """
+    A book move for gs picked at random in proportion to the weights, or None when the position isn't in the book
+    """
+
+    def probe(self, gs, validmoves, rng=random):
+        found = self.entries(gs.zobrist)
+        if not found:
+            return None
+        weights = {}
+        for move, weight in found:
+            weights[move] = weights.get(move, 0) + weight
+        candidates = []
+        for move in validmoves:
+            weight = weights.get(encodemove(move), 0)
+            if weight:
+                candidates.append((move, weight))
+        if not candidates:
+            return None
+        pick = rng.uniform(0, sum(weight for move, weight in candidates))
+        for move, weight in candidates:
+            pick -= weight
+            if pick <= 0:
+                return move
+        return candidates[-1][0]
+
+
+"""
+Builds a book from PGN files: every move played in the first plies of a game is counted,
+2 for the winner's moves, 1 in a draw, losing moves are left out.
+"""
+
+
+def buildbook(pgnpaths, outpath, plies=20):
+    counts = {}
+    games = 0
+    for path in pgnpaths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for game in PgnIO.readgames(f):
+                points = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}.get(game.result)
+                if points is None:
+                    continue
+                try:
+                    if "FEN" in game.headers:
+                        gs = BitboardEngine.GameState.from_fen(game.headers["FEN"])
+                    else:
+                        gs = BitboardEngine.GameState()
+                except ValueError:
+                    continue  # a bad FEN header, the game is skipped
+                try:
+                    for san in game.moves[:plies]:
+                        move = PgnIO.parsesan(san, gs.getValidMoves())
+                        weight = points[0] if gs.whiteToMove else points[1]
+                        if weight:
+                            moves = counts.setdefault(gs.zobrist, {})
+                            code = encodemove(move)
+                            moves[code] = moves.get(code, 0) + weight
+                        gs.makeMove(move)
+                except ValueError:
+                    pass  # the moves before the bad one are still counted
+                games += 1
+
+    # weights have to fit in 16 bits
+    top = max((weight for moves in counts.values() for weight in moves.values()), default=1)
+    scale = max(1, -(-top // 0xFFFF))
+    entries = 0
+    with open(outpath, "wb") as out:
+        for key in sorted(counts):
+            for code, weight in sorted(counts[key].items(), key=lambda item: -item[1]):
+                out.write(ENTRY.pack(key, code, max(1, weight // scale), 0))
+                entries += 1
+    return games, entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Chess.OpeningBook", description="Polyglot opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+")
+    build.add_argument("-o", "--output", default="book.bin")
+    build.add_argument("--plies", type=int, default=20, help="how deep into each game moves are taken")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("fen", nargs="?")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        games, entries = buildbook(args.pgn, args.output, args.plies)
+        print("games: %d\nentries: %d" % (games, entries))
+    else:
+        book = OpeningBook(args.book)
+        gs = BitboardEngine.GameState.from_fen(args.fen) if args.fen else BitboardEngine.GameState()
+        found = book.entries(gs.zobrist)
+        total = sum(weight for move, weight in found) or 1
+        for move, weight in found:
+            print("%-6s %6d  %5.1f%%" % (uci(move), weight, 100 * weight / total))
+        book.close()
+
+
+if __name__ == '__main__':
+    main()
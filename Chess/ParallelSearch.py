@@ -0,0 +1,157 @@
+"""
+Lazy SMP: the search runs in this process as usual while helper processes search the same position
+at the same time, all of them reading and writing one transposition table in shared memory.
+The helpers fill the table with results the main search picks up (cutoffs, better move ordering),
+so it gets deeper in the same time. Each helper has its own GameState copy and searches the root
+moves in a different order, so they don't all do the same work. No search goes past max_depth.
+
+    search = ParallelSearch(workers=4)
+    move = search.findbestmove(gs, gs.getValidMoves(), time_limit=5)
+    search.close()
+
+Single process search (SmartMoveFinder.findbestmove) stays the default, this is opt-in.
+python -m Chess.ParallelSearch measures time to depth against the number of workers.
+"""
+
+import multiprocessing
+import os
+import pickle
+import random
+import sys
+import time
+from multiprocessing import shared_memory
+
+from Chess import SmartMoveFinder, BitboardEngine
+from Chess.TranspositionTable import TranspositionTable, buffersize
+
+# set in the helper processes by attach()
+sharedmemory = None
+
+
+def attach(name, size_mb, stopevent):
+    global sharedmemory
+    sharedmemory = shared_memory.SharedMemory(name=name)
+    SmartMoveFinder.tt = TranspositionTable(size_mb, sharedmemory.buf)
+    SmartMoveFinder.abortcheck = stopevent.is_set
+
+
+"""
+Runs in a helper process, returns (deepest finished depth, move id, nodes)
+"""
+
+
+def helpersearch(position, time_limit, max_depth, age, seed):
+    gs = pickle.loads(position)
+    validmoves = gs.getValidMoves()
+    random.Random(seed).shuffle(validmoves)
+    finished = [0]
+
+    def info(depth, score, nodes, seconds):
+        finished[0] = depth
+
+    SmartMoveFinder.tt.age = (age - 1) & 63  # findbestmove steps it to the main search's age
+    move = SmartMoveFinder.findbestmove(gs, validmoves, time_limit, max_depth, info)
+    return finished[0], move.moveID if move is not None else 0, SmartMoveFinder.nodes
+
+
+class ParallelSearch:
+
+    def __init__(self, workers=None, size_mb=SmartMoveFinder.TT_SIZE_MB):
+        self.workers = workers or os.cpu_count() or 1
+        self.memory = shared_memory.SharedMemory(create=True, size=buffersize(size_mb))
+        self.tt = TranspositionTable(size_mb, self.memory.buf)
+        self.stopevent = multiprocessing.Event()
+        self.pool = None
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(self.workers - 1, attach, (self.memory.name, size_mb, self.stopevent))
+        self.nodes = 0  # nodes searched by all the processes in the last search
+
+    """
+    Same as SmartMoveFinder.findbestmove, with the helpers searching alongside.
+    The move of the deepest finished search wins, the main search's on a tie.
+    """
+
+    def findbestmove(self, gs, validmoves, time_limit=None, max_depth=SmartMoveFinder.DEPTH, info=None):
+        self.stopevent.clear()
+        oldtt = SmartMoveFinder.tt
+        SmartMoveFinder.tt = self.tt
+        results = []
+        if self.pool is not None:
+            # pickled here, the pool sends tasks from another thread while this one is already searching gs.
+            # The light copy leaves out the move log and undo history, which the helpers don't need.
+            position = pickle.dumps(gs.copy())
+            for i in range(1, self.workers):
+                results.append(self.pool.apply_async(helpersearch, (position, time_limit, max_depth,
+                                                                     (self.tt.age + 1) & 63, i)))
+        finished = [0]
+
+        def maininfo(depth, score, nodes, seconds):
+            finished[0] = depth
+            if info is not None:
+                info(depth, score, nodes, seconds)
+
+        try:
+            bestmove = SmartMoveFinder.findbestmove(gs, validmoves, time_limit, max_depth, maininfo)
+        finally:
+            SmartMoveFinder.tt = oldtt
+            # the main search decides when everyone stops
+            self.stopevent.set()
+        self.nodes = SmartMoveFinder.nodes
+        depth = finished[0]
+        for result in results:
+            try:
+                helperdepth, moveid, nodes = result.get()
+            except Exception as e:
+                # a failed helper doesn't cost the search its move, the main thread's one stands
+                print("helper search failed: %r" % e, file=sys.stderr)
+                continue
+            self.nodes += nodes
+            if helperdepth > depth:
+                for move in validmoves:
+                    if move.moveID == moveid:
+                        bestmove, depth = move, helperdepth
+                        break
+        return bestmove
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        # the table's views into the shared memory have to go before it can be closed
+        self.tt.keys.release()
+        self.tt.data.release()
+        self.tt = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+"""
+Time to reach a fixed depth on a few positions for 1 to max_workers processes
+"""
+
+
+def benchmark(max_workers, depth=5):
+    fens = ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+            "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+            "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8"]
+    base = None
+    for workers in range(1, max_workers + 1):
+        search = ParallelSearch(workers)
+        elapsed = 0
+        nodes = 0
+        for fen in fens:
+            gs = BitboardEngine.GameState.from_fen(fen)
+            search.tt.clear()
+            start = time.perf_counter()
+            search.findbestmove(gs, gs.getValidMoves(), max_depth=depth)
+            elapsed += time.perf_counter() - start
+            nodes += search.nodes
+        search.close()
+        base = base or elapsed
+        print("workers %2d  %6.2fs  speedup %.2f  %8d nodes  %7d nps" %
+              (workers, elapsed, base / elapsed, nodes, nodes / elapsed))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1)
@@ -0,0 +1,267 @@
+"""
+Reading and writing games in PGN.
+readgames() is a generator that holds one game at a time, so files of any size are read in
+constant memory, and replay() plays a game's moves through a GameState.
+movesan() gives the Standard Algebraic Notation of a move (captures, disambiguation, promotion,
+check and mate marks) and writegame() writes a whole game out.
+
+    python -m Chess.PgnIO games.pgn    replays every game and reports games per second
+"""
+
+import re
+import sys
+import time
+
+from Chess import ChessEngine, BitboardEngine
+
+SEVEN_TAG_ROSTER = ["Event", "Site", "Date", "Round", "White", "Black", "Result"]
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+TAG_RE = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# comments, variations, NAGs and move numbers are matched so they can be skipped
+TOKEN_RE = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s(){};]+')
+SAN_RE = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+
+class PgnGame:
+
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []  # SAN strings
+        self.result = result
+
+
+"""
+Yields a PgnGame for every game in a PGN file (an open text file or any iterable of lines)
+"""
+
+
+def readgames(lines):
+    headers = {}
+    movetext = []
+    incomment = False  # inside a {} comment that goes on over the line ends
+    for line in lines:
+        line = line.strip()
+        if incomment:
+            movetext.append(line)
+            incomment = commentopen(line, True)
+        elif line.startswith("["):
+            if movetext:
+                yield parsegame(headers, movetext)
+                headers = {}
+                movetext = []
+            match = TAG_RE.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        elif line.startswith("%"):  # escaped line
+            continue
+        elif line:
+            movetext.append(line)
+            incomment = commentopen(line, False)
+    if headers or movetext:
+        yield parsegame(headers, movetext)
+
+
+"""
+True if a {} comment is still open at the end of the line, incomment tells if one was open at its start.
+A ; comment runs to the end of the line, braces in it don't count.
+"""
+
+
+def commentopen(line, incomment):
+    for ch in line:
+        if incomment:
+            incomment = ch != "}"
+        elif ch == "{":
+            incomment = True
+        elif ch == ";":
+            break
+    return incomment
+
+
+def parsegame(headers, movetext):
+    moves = []
+    result = headers.get("Result", "*")
+    depth = 0  # variation nesting, moves inside a variation aren't part of the game
+    for token in TOKEN_RE.findall("\n".join(movetext)):
+        first = token[0]
+        if first == "(":
+            depth += 1
+        elif first == ")":
+            depth -= 1
+        elif token in RESULTS:
+            if not depth:
+                result = token
+        elif depth or first in "{;$" or token[-1] == ".":
+            continue
+        else:
+            moves.append(token)
+    return PgnGame(headers, moves, result)
+
+
+"""
+Finds the move a SAN string stands for among the valid moves, raises ValueError if there isn't exactly one
+"""
+
+
+def parsesan(san, validmoves):
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        kingside = len(text) == 3
+        for move in validmoves:
+            if move.isCastle and (move.endCol == 6) == kingside:
+                return move
+        raise ValueError("illegal move: %s" % san)
+
+    match = SAN_RE.match(text)
+    if not match:
+        raise ValueError("bad SAN: %s" % san)
+    piece, fromfile, fromrank, to, promotion = match.groups()
+    piece = piece.lower() if piece else "p"
+    endRow = ChessEngine.Move.ranksToRows[to[1]]
+    endCol = ChessEngine.Move.filesToCols[to[0]]
+    fromcol = ChessEngine.Move.filesToCols[fromfile] if fromfile else None
+    fromrow = ChessEngine.Move.ranksToRows[fromrank] if fromrank else None
+    promotion = promotion.lower() if promotion else None
+
+    found = None
+    for move in validmoves:
+        if move.endRow != endRow or move.endCol != endCol or move.movedPiece[1] != piece or move.isCastle:
+            continue
+        if (fromcol is not None and move.startCol != fromcol) or (fromrow is not None and move.startRow != fromrow):
+            continue
+        if move.isPawnPromotion and move.promotionChoice != (promotion or "q"):
+            continue
+        if found is not None:
+            raise ValueError("ambiguous move: %s" % san)
+        found = move
+    if found is None:
+        raise ValueError("illegal move: %s" % san)
+    return found
+
+
+"""
+SAN of a move that is valid in gs, validmoves are gs.getValidMoves() if you have them already.
+The move is played and taken back to see if it gives check.
+"""
+
+
+def movesan(gs, move, validmoves=None):
+    if move.isCastle:
+        san = "O-O" if move.endCol > move.startCol else "O-O-O"
+    else:
+        piece = move.movedPiece[1]
+        target = move.getRankFile(move.endRow, move.endCol)
+        if piece == "p":
+            if move.capturedPiece != '--':
+                san = move.colsToFiles[move.startCol] + "x" + target
+            else:
+                san = target
+            if move.isPawnPromotion:
+                san += "=" + move.promotionChoice.upper()
+        else:
+            if validmoves is None:
+                validmoves = gs.getValidMoves()
+            # other pieces of the same kind that can go to the same square
+            others = [m for m in validmoves if m.movedPiece == move.movedPiece and m.endRow == move.endRow and
+                      m.endCol == move.endCol and (m.startRow, m.startCol) != (move.startRow, move.startCol)]
+            san = piece.upper()
+            if others:
+                if all(m.startCol != move.startCol for m in others):
+                    san += move.colsToFiles[move.startCol]
+                elif all(m.startRow != move.startRow for m in others):
+                    san += move.rowsToRanks[move.startRow]
+                else:
+                    san += move.getRankFile(move.startRow, move.startCol)
+            if move.capturedPiece != '--':
+                san += "x"
+            san += target
+
+    gs.makeMove(move)
+    gs.getValidMoves()
+    if gs.checkmate:
+        san += "#"
+    elif gs.incheck:
+        san += "+"
+    gs.undoMove()
+    return san
+
+
+"""
+Plays a game's moves through a new GameState (from the FEN tag if there is one) and returns it
+"""
+
+
+def replay(game, gamestate=BitboardEngine.GameState):
+    if "FEN" in game.headers:
+        gs = gamestate.from_fen(game.headers["FEN"])
+    else:
+        gs = gamestate()
+    for san in game.moves:
+        gs.makeMove(parsesan(san, gs.getValidMoves()))
+    return gs
+
+
+"""
+Writes a game as PGN: moves are Move objects played from the starting position (or fen),
+headers missing from the seven tag roster are filled with "?"
+"""
+
+
+def writegame(f, moves, headers=None, result="*", fen=None):
+    tags = dict(headers or {})
+    tags["Result"] = result
+    if fen is not None:
+        tags["SetUp"] = "1"
+        tags["FEN"] = fen
+    for name in SEVEN_TAG_ROSTER:
+        f.write('[%s "%s"]\n' % (name, tags.get(name, "?").replace("\\", "\\\\").replace('"', '\\"')))
+    for name, value in tags.items():
+        if name not in SEVEN_TAG_ROSTER:
+            f.write('[%s "%s"]\n' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')))
+    f.write("\n")
+
+    gs = ChessEngine.GameState.from_fen(fen) if fen is not None else ChessEngine.GameState()
+    number = gs.fullmoveStart
+    tokens = []
+    if not gs.whiteToMove and moves:
+        tokens.append("%d..." % number)
+    for move in moves:
+        if gs.whiteToMove:
+            tokens.append("%d." % number)
+        tokens.append(movesan(gs, move))
+        if not gs.whiteToMove:
+            number += 1
+        gs.makeMove(move)
+    tokens.append(result)
+
+    # movetext lines are kept under 80 characters
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            f.write(line + "\n")
+            line = token
+        else:
+            line = line + " " + token if line else token
+    f.write(line + "\n\n")
+
+
+def main(path):
+    games = plies = 0
+    start = time.perf_counter()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for game in readgames(f):
+            try:
+                replay(game)
+            except ValueError as e:
+                print("game %d (%s - %s): %s" % (games + 1, game.headers.get("White", "?"),
+                                                 game.headers.get("Black", "?"), e))
+            games += 1
+            plies += len(game.moves)
+    elapsed = time.perf_counter() - start
+    print("games: %d\nplies: %d\ntime: %.2fs\ngames/s: %.1f\nplies/s: %d" %
+          (games, plies, elapsed, games / max(elapsed, 1e-9), plies / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,117 @@
+"""
+Search statistics, opt-in:
+
+    SmartMoveFinder.stats = SearchStats("stats.jsonl")
+
+While it's set, findbestmove counts nodes, quiescence nodes, transposition table hits and cutoffs, and beta cutoffs
+by the index of the move that caused them. It also times getValidMoves, makeMove, undoMove and scoreboard (inclusive
+times: a call made inside another timed call counts for both). After each search the numbers are in last, and a JSON
+line is appended to the file if one was given. With stats left at None the search runs untouched: the timed methods
+are those of a TimedGameState that stands in for the GameState during the search, and scoreboard is timed by the
+search calling evaluate instead, nothing is patched.
+"""
+
+import json
+import time
+
+TIMED_METHODS = ("getValidMoves", "makeMove", "undoMove")
+
+
+class SearchStats:
+
+    def __init__(self, path=None):
+        self.path = path  # JSON lines file, one line per search
+        self.last = None  # todict() of the last search
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.tthits = 0
+        self.ttcutoffs = 0
+        self.cutoffs = []  # beta cutoffs in the main search by the index of the move that caused them
+        self.times = {}
+        self.calls = {}
+        self.depth = 0
+        self.score = 0
+        self.seconds = 0
+        self.move = None
+
+    def cutoff(self, index):
+        while len(self.cutoffs) <= index:
+            self.cutoffs.append(0)
+        self.cutoffs[index] += 1
+
+    """
+    Wraps fn to add its calls and time under key
+    """
+
+    def timed(self, key, fn):
+        times = self.times
+        calls = self.calls
+        times[key] = 0
+        calls[key] = 0
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            result = fn(*args, **kwargs)
+            times[key] += clock() - start
+            calls[key] += 1
+            return result
+        return wrapper
+
+    """
+    Called by findbestmove before searching with the GameState and the evaluation function,
+    returns the TimedGameState to search on. evaluate is the timed evaluation function until the next begin.
+    """
+
+    def begin(self, gs, evaluate):
+        self.reset()
+        self.evaluate = self.timed("scoreboard", evaluate)
+        timedgs = TimedGameState(gs, self)
+        self.started = time.perf_counter()
+        return timedgs
+
+    """
+    Called by findbestmove when the search is over, even when it ended with an exception, and exports the numbers
+    """
+
+    def end(self, nodes, depth, score, move):
+        self.seconds = time.perf_counter() - self.started
+        self.nodes = nodes
+        self.depth = depth
+        self.score = score
+        self.move = move.getUciNotation() if move is not None else None
+        self.last = self.todict()
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(self.last) + "\n")
+
+    def todict(self):
+        cutoffs = sum(self.cutoffs)
+        return {"move": self.move, "depth": self.depth, "score": self.score, "seconds": round(self.seconds, 6),
+                "nodes": self.nodes, "qnodes": self.qnodes, "nps": int(self.nodes / max(self.seconds, 1e-9)),
+                "tthits": self.tthits, "ttcutoffs": self.ttcutoffs, "betacutoffs": cutoffs,
+                "firstmovecutoffs": round(self.cutoffs[0] / cutoffs, 4) if cutoffs else None,
+                "cutoffsbyindex": self.cutoffs,
+                "times": {key: round(value, 6) for key, value in self.times.items()}, "calls": dict(self.calls)}
+
+    def tojson(self):
+        return json.dumps(self.todict(), indent=2)
+
+
+class TimedGameState:
+
+    """
+    Stands in for gs during a search: getValidMoves, makeMove and undoMove go through the timers of stats,
+    every other attribute is read from gs
+    """
+
+    def __init__(self, gs, stats):
+        self.gs = gs
+        for name in TIMED_METHODS:
+            setattr(self, name, stats.timed(name, getattr(gs, name)))
+
+    def __getattr__(self, name):
+        return getattr(self.gs, name)
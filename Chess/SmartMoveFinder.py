@@ -1,11 +1,90 @@
-import copy
-
+import os
 import random
+import time
+
+from Chess import Evaluation, OpeningBook, Tablebase
+from Chess.TranspositionTable import TranspositionTable, EXACT, LOWER, UPPER
 
-pieceScore = {'k': 0, 'q': 9, 'r': 5, 'b': 3, 'n': 3, 'p': 1}
-CHECKMATE = 1000
+pieceScore = Evaluation.pieceValues  # centipawns
+CHECKMATE = 100000
 STALEMATE = 0
 DEPTH = 4
+MAX_PLY = 64
+DELTA_MARGIN = 200  # a capture has to be able to lift the score this close to alpha to be searched in quiescence
+TT_SIZE_MB = 16
+BOOK_FILE = os.path.join(os.path.dirname(__file__), "book.bin")  # used when it exists, see OpeningBook
+
+tt = TranspositionTable(TT_SIZE_MB)
+nodes = 0
+deadline = None  # time.perf_counter() value at which the search gives up
+stopsearch = False
+abortcheck = None  # optional function polled with the clock, returning True stops the search (see ParallelSearch)
+book = None  # OpeningBook probed before searching
+tablebases = None  # Tablebase.Tablebases probed once few enough pieces are left
+stats = None  # SearchStats, filled in by every search while it's set
+
+# move ordering
+ORDER_VALUES = {'k': 10, 'q': 9, 'r': 5, 'b': 3, 'n': 3, 'p': 1}  # pieceScore in pawns, with a king worth something
+TT_MOVE = 1 << 20
+CAPTURE = 1 << 18  # captures and promotions, ranked most valuable victim / least valuable attacker
+KILLER = 1 << 17  # quiet moves that caused a cutoff at the same ply, the second killer gets KILLER - 1
+HISTORY_MAX = KILLER // 2  # the history table is halved when a score reaches this
+
+killers = [[0, 0] for _ in range(MAX_PLY)]
+history = {color + piece: [0] * 64 for color in "wb" for piece in "pnbrqk"}
+
+"""
+Polled every 256 nodes (a few milliseconds even on the mailbox backend), True when the search has to give up
+"""
+
+
+def outoftime():
+    return (deadline is not None and time.perf_counter() > deadline) or (abortcheck is not None and abortcheck())
+
+
+"""
+Replaces the transposition table with an empty one of the given size
+"""
+
+
+def resizett(size_mb):
+    global tt
+    tt = TranspositionTable(size_mb)
+
+
+"""
+Opens the Polyglot book findbestmove plays from, None turns the book off
+"""
+
+
+def loadbook(path):
+    global book
+    opened = OpeningBook.OpeningBook(path) if path else None  # opened first, a bad path keeps the old book
+    if book is not None:
+        book.close()
+    book = opened
+
+
+if os.path.exists(BOOK_FILE):
+    loadbook(BOOK_FILE)
+
+
+"""
+Maps the tablebase files in a directory (see Tablebase), None turns them off
+"""
+
+
+def loadtablebases(path):
+    global tablebases
+    opened = Tablebase.Tablebases(path) if path else None
+    if tablebases is not None:
+        tablebases.close()
+    tablebases = opened
+
+
+if os.path.isdir(Tablebase.TABLEBASE_DIR):
+    loadtablebases(Tablebase.TABLEBASE_DIR)
+
 
 """
 Chooses a random move
@@ -64,36 +143,104 @@ Finds the best move based on material
 #     return bestmove
 
 
-def encode(board):
-    s = ''
-    for r in board:
-        for c in r:
-            s += c
-    return s
+"""
+Searches one ply deeper at a time until max_depth or until time_limit seconds are up,
+the move returned is the best one of the last search that finished.
+info(depth, score, nodes, seconds) is called after every finished iteration if given, setting
+stopsearch from another thread ends the search early.
+"""
 
 
-def findbestmove(gs, validmoves):
-    global nextmove
+def findbestmove(gs, validmoves, time_limit=None, max_depth=DEPTH, info=None):
+    global nextmove, nodes, deadline, stopsearch
     nextmove = None
-    foo = copy.deepcopy(gs.castlelog)
-    # random.shuffle(validmoves)
-    # minmax(gs, validmoves, DEPTH, gs.whiteToMove, {}, {})
-    negamaxalphabeta(gs, validmoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    gs.castlelog = foo
-    gs.castle = foo[-1]
+    if book is not None:
+        nextmove = book.probe(gs, validmoves)
+        if nextmove is not None:
+            return nextmove
+    if tablebases is not None and gs.pieces <= Tablebase.MAX_PIECES and tablebases.probe(gs) is not None:
+        start = time.perf_counter()
+        nextmove = tablebasemove(gs, validmoves)
+        if info is not None:
+            info(1, tbscore(tablebases.probe(gs), 0), len(validmoves), time.perf_counter() - start)
+        return nextmove
+    tt.newsearch()
+    nodes = 0
+    stopsearch = False
+    newsearchordering()
+    if stats is not None:
+        gs = stats.begin(gs, scoreboard)
+    start = time.perf_counter()
+    bestmove = None
+    finished = bestscore = 0
+    deadline = start + time_limit if time_limit is not None else None
+    try:
+        for depth in range(1, max_depth + 1):
+            # the principal variation of the last iteration is in the table, ordermoves() searches it first
+            # random.shuffle(validmoves)
+            # minmax(gs, validmoves, DEPTH, gs.whiteToMove, {}, {})
+            score = negamaxalphabeta(gs, validmoves, depth, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
+            if stopsearch:
+                if bestmove is None:
+                    # stopped during the first iteration: the best root move searched so far will have to do,
+                    # or the first one in the order the root searched them in
+                    bestmove = nextmove if nextmove is not None or not validmoves else validmoves[0]
+                break
+            bestmove = nextmove
+            finished, bestscore = depth, score
+            if info is not None:
+                info(depth, score, nodes, time.perf_counter() - start)
+            # a mate within the plies searched is the whole story, searching deeper can't change it
+            if abs(score) >= CHECKMATE - MAX_PLY and CHECKMATE - abs(score) <= depth:
+                break
+            # the next iteration takes a few times longer than this one, don't start what can't finish
+            if time_limit is not None and time.perf_counter() - start > time_limit / 2:
+                break
+    finally:
+        if stats is not None:
+            stats.end(nodes, finished, bestscore, bestmove)
+    deadline = None
+    nextmove = bestmove
     return nextmove
 
 
+"""
+The principal variation of the last search, followed through the transposition table from gs
+"""
+
+
+def principalvariation(gs, depth):
+    pv = []
+    seen = set()
+    while len(pv) < depth and gs.zobrist not in seen:
+        entry = tt.probe(gs.zobrist)
+        if entry is None or not entry[3]:
+            break
+        seen.add(gs.zobrist)
+        move = None
+        for m in gs.getValidMoves():
+            if m.moveID == entry[3]:
+                move = m
+                break
+        if move is None:
+            break
+        pv.append(move)
+        gs.makeMove(move)
+    for move in pv:
+        gs.undoMove()
+    return pv
+
+
 def minmax(gs, validmoves, depth, wtm, wsco, bsco):
     random.shuffle(validmoves)
     global nextmove
-    encoded = encode(gs.board)
+    key = gs.zobrist
     if depth == 0:
         return scoreboard(gs)
 
     if wtm:
-        if encoded in wsco.keys():
-            return wsco[encoded]
+        if key in wsco.keys():
+            return wsco[key]
         max = -CHECKMATE
         for move in validmoves:
             gs.makeMove(move)
@@ -103,14 +250,13 @@ def minmax(gs, validmoves, depth, wtm, wsco, bsco):
                 max = score
                 if depth == DEPTH:
                     nextmove = move
-                    print(max)
             gs.undoMove()
-        wsco[encoded] = max
+        wsco[key] = max
         return max
 
     else:
-        if encoded in bsco.keys():
-            return bsco[encoded]
+        if key in bsco.keys():
+            return bsco[key]
         min = CHECKMATE
         for move in validmoves:
             gs.makeMove(move)
@@ -120,9 +266,8 @@ def minmax(gs, validmoves, depth, wtm, wsco, bsco):
                 min = score
                 if depth == DEPTH:
                     nextmove = move
-                    print(min)
             gs.undoMove()
-        bsco[encoded] = min
+        bsco[key] = min
         return min
 
 
@@ -144,28 +289,281 @@ def negamax(gs, validmoves, depth, turnmltp):
     return max
 
 
-def negamaxalphabeta(gs, validmoves, depth, alpha, beta, turnmltp):
-    global nextmove
+"""
+validmoves=None lets the node generate its own moves in two stages, captures first and the quiet moves
+only when no capture caused a cutoff, most nodes never need their quiet moves
+"""
+
+
+def negamaxalphabeta(gs, validmoves, depth, alpha, beta, turnmltp, ply=0):
+    global nextmove, nodes, stopsearch
+    nodes += 1
+    if nodes & 255 == 0 and outoftime():
+        stopsearch = True
+    if validmoves is not None:
+        # the caller's getValidMoves() told us if the game is over
+        if gs.checkmate:
+            return -CHECKMATE + ply  # the sooner the better for the winner
+        if gs.stalemate:
+            return STALEMATE
+
+    if ply > 0 and (gs.repetitions[gs.zobrist] > 1 or gs.halfmove >= 100):
+        # the position came up before in the game or on this line: the side that can avoid the repeat would have,
+        # so it's scored as a draw and the cycle isn't searched again. Same for the fifty-move rule.
+        return STALEMATE
+
+    if ply > 0 and gs.pieces <= Tablebase.MAX_PIECES and tablebases is not None:
+        found = tablebases.probe(gs)
+        if found is not None:
+            return tbscore(found, ply)
+
+    alphaorig = alpha
+    ttmove = 0
+    entry = tt.probe(gs.zobrist)
+    if entry is not None:
+        ttmove = entry[3]
+        if stats is not None:
+            stats.tthits += 1
+        # the root always searches, it has to pick nextmove
+        if ply > 0 and entry[0] >= depth:
+            score, bound = ttscore(entry[1], -ply), entry[2]
+            if bound == EXACT:
+                if stats is not None:
+                    stats.ttcutoffs += 1
+                return score
+            elif bound == LOWER:
+                alpha = score if score > alpha else alpha
+            elif bound == UPPER:
+                beta = score if score < beta else beta
+            if alpha >= beta:
+                if stats is not None:
+                    stats.ttcutoffs += 1
+                return score
+
     if depth == 0:
-        return turnmltp * scoreboard(gs)
+        return quiescence(gs, alpha, beta, turnmltp, ply)
+
+    staged = False
+    if validmoves is None:
+        validmoves = gs.getValidMoves("captures")
+        if gs.incheck or (ttmove and not any(move.moveID == ttmove for move in validmoves)):
+            # evasions are few and a quiet table move has to go first, no point in staging
+            validmoves = gs.getValidMoves()
+            if gs.checkmate:
+                return -CHECKMATE + ply
+            if gs.stalemate:
+                return STALEMATE
+        else:
+            staged = True
 
     max = -CHECKMATE
-    for move in validmoves:
+    bestmove = None
+    tried = 0  # moves of the earlier stage, for counting cutoffs by move index
+    while True:
+        ordermoves(validmoves, ttmove, ply)
+        for i, move in enumerate(validmoves):
+            gs.makeMove(move)
+            score = -negamaxalphabeta(gs, None, depth - 1, -beta, -alpha, -turnmltp, ply + 1)
+            gs.undoMove()
+            if stopsearch:
+                return 0
+            if score > max:
+                max = score
+                bestmove = move
+                if ply == 0:
+                    nextmove = move
+            if max > alpha:
+                alpha = max
+            if alpha >= beta:
+                if move.capturedPiece == '--' and not move.isPawnPromotion:
+                    updatequiet(move, depth, ply)
+                if stats is not None:
+                    stats.cutoff(tried + i)
+                break
+        if alpha >= beta or not staged:
+            break
+        # no capture was good enough, on to the quiet moves
+        staged = False
+        tried = len(validmoves)
+        validmoves = gs.getValidMoves("quiets")
+
+    if bestmove is None:
+        # nothing to move and not in check, in check everything was generated at once
+        return STALEMATE
+
+    if max <= alphaorig:
+        bound = UPPER
+    elif max >= beta:
+        bound = LOWER
+    else:
+        bound = EXACT
+    tt.store(gs.zobrist, depth, ttscore(max, ply), bound, bestmove.moveID)
+    return max
+
+
+"""
+Searches captures only until the position is quiet, so the evaluation never stops in the middle of an exchange
+"""
+
+
+def quiescence(gs, alpha, beta, turnmltp, ply):
+    global nodes, stopsearch
+    nodes += 1
+    if stats is not None:
+        stats.qnodes += 1
+    if nodes & 255 == 0 and outoftime():
+        stopsearch = True
+
+    moves = gs.getValidMoves("captures")
+    incheck = gs.incheck
+    if incheck:
+        # every evasion has to be looked at, standing pat isn't an option in check
+        moves = gs.getValidMoves()
+        if gs.checkmate:
+            return -CHECKMATE + ply
+        if ply >= MAX_PLY:
+            # a check sequence this long isn't followed any further, the static score has to do
+            return turnmltp * (scoreboard(gs) if stats is None else stats.evaluate(gs))
+        standpat = -CHECKMATE
+    else:
+        standpat = turnmltp * (scoreboard(gs) if stats is None else stats.evaluate(gs))
+        if standpat >= beta or ply >= MAX_PLY:
+            return standpat
+        if standpat > alpha:
+            alpha = standpat
+
+    ordermoves(moves, 0, MAX_PLY)
+    max = standpat
+    for move in moves:
+        if not incheck:
+            # delta pruning, even winning the piece for free can't get the score up to alpha
+            gain = pieceScore[move.capturedPiece[1]] if move.capturedPiece != '--' else 0
+            if move.isPawnPromotion:
+                gain += pieceScore[move.promotionChoice] - pieceScore['p']
+            if standpat + gain + DELTA_MARGIN <= alpha:
+                continue
         gs.makeMove(move)
-        opmoves = gs.getValidMoves()
-        score = -negamaxalphabeta(gs, opmoves, depth - 1, -beta, -alpha,  -turnmltp)
+        score = -quiescence(gs, -beta, -alpha, -turnmltp, ply + 1)
+        gs.undoMove()
+        if stopsearch:
+            return 0
         if score > max:
             max = score
-            if depth == DEPTH:
-                nextmove = move
-        gs.undoMove()
-        if max > alpha:
-            alpha = max
-        if alpha >= beta:
-            break
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
     return max
 
 
+"""
+Sorts the moves so the most promising ones are searched first: the table move, captures and
+promotions by MVV-LVA, the killer moves of this ply, then the other quiet moves by history score
+"""
+
+
+def ordermoves(validmoves, ttmove, ply):
+    killer1, killer2 = killers[ply] if ply < MAX_PLY else (0, 0)
+
+    def movescore(move):
+        if move.moveID == ttmove:
+            return TT_MOVE
+        if move.capturedPiece != '--' or move.isPawnPromotion:
+            score = CAPTURE - ORDER_VALUES[move.movedPiece[1]]
+            if move.capturedPiece != '--':
+                score += 10 * ORDER_VALUES[move.capturedPiece[1]]
+            if move.isPawnPromotion:
+                score += 10 * ORDER_VALUES[move.promotionChoice]
+            return score
+        if move.moveID == killer1:
+            return KILLER
+        if move.moveID == killer2:
+            return KILLER - 1
+        return history[move.movedPiece][move.endRow * 8 + move.endCol]
+
+    validmoves.sort(key=movescore, reverse=True)
+
+
+"""
+A quiet move caused a beta cutoff: make it a killer for this ply and raise its history score
+"""
+
+
+def updatequiet(move, depth, ply):
+    if ply < MAX_PLY and killers[ply][0] != move.moveID:
+        killers[ply][1] = killers[ply][0]
+        killers[ply][0] = move.moveID
+    table = history[move.movedPiece]
+    sq = move.endRow * 8 + move.endCol
+    table[sq] += depth * depth
+    if table[sq] >= HISTORY_MAX:
+        agehistory()
+
+
+def agehistory():
+    for table in history.values():
+        for sq in range(64):
+            table[sq] //= 2
+
+
+"""
+Killers belong to the positions of one search, history is only aged so it carries over to the next move
+"""
+
+
+def newsearchordering():
+    for k in killers:
+        k[0] = k[1] = 0
+    agehistory()
+
+
+"""
+Search score of a tablebase result, mate scores counted from the root like the ones the search finds
+"""
+
+
+def tbscore(found, ply):
+    result, plies = found
+    if result > 0:
+        return CHECKMATE - ply - plies
+    if result < 0:
+        return -CHECKMATE + ply + plies
+    return STALEMATE
+
+
+"""
+The move the tablebase rates best: the quickest mate when winning, the slowest when losing, a drawing move otherwise
+"""
+
+
+def tablebasemove(gs, validmoves):
+    bestmove = None
+    best = -CHECKMATE - 1
+    for move in validmoves:
+        gs.makeMove(move)
+        found = tablebases.probe(gs)
+        gs.undoMove()
+        # a capture of the last piece or a minor piece promotion leaves no mating material
+        score = -tbscore(found, 1) if found is not None else STALEMATE
+        if score > best:
+            best = score
+            bestmove = move
+    return bestmove
+
+
+"""
+Mate scores count the plies from the root, the table stores them counted from the position itself
+"""
+
+
+def ttscore(score, ply):
+    if score > CHECKMATE - MAX_PLY:
+        return score + ply
+    if score < -CHECKMATE + MAX_PLY:
+        return score - ply
+    return score
+
+
 def scoreboard(gs):
     if gs.checkmate:
         if gs.whiteToMove:
@@ -176,15 +574,8 @@ def scoreboard(gs):
     if gs.stalemate:
         return STALEMATE
 
-    score = 0
-    for row in gs.board:
-        for sq in row:
-            if sq[0] == 'w':
-                score += pieceScore[sq[1]]
-            elif sq[0] == 'b':
-                score -= pieceScore[sq[1]]
-
-    return score
+    # makeMove and undoMove keep the totals up to date
+    return Evaluation.taper(gs.mg['w'] - gs.mg['b'], gs.eg['w'] - gs.eg['b'], gs.phase)
 
 
 """
@@ -205,12 +596,8 @@ def scoreMaterial(board):
 
 
 if __name__ == '__main__':
-    b = [
-        ['br', '--', 'bb', 'bq', 'bk', 'bb', 'bn', 'br'],
-        ['bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp', 'bp'],
-        ['wb', '--', 'bn', '--', '--', '--', '--', '--'],
-        ['--', '--', '--', '--', '--', '--', '--', '--'],
-        ['--', '--', '--', '--', 'wp', '--', '--', '--'],
-        ['--', '--', '--', '--', '--', '--', '--', '--'],
-        ['wp', 'wp', 'wp', 'wp', '--', 'wp', 'wp', 'wp'],
-        ['wr', 'wn', 'wb', 'wq', 'wk', '--', 'wn', 'wr']]
+    from Chess import ChessEngine
+    # the bishop on a6 can be taken
+    gs = ChessEngine.GameState.from_fen("r1bqkbnr/pppppppp/B1n5/8/4P3/8/PPPP1PPP/RNBQK1NR b KQkq - 3 3")
+    move = findbestmove(gs, gs.getValidMoves(), time_limit=5)
+    print(move.getChessNotation(), scoreboard(gs))
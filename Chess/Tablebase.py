@@ -0,0 +1,267 @@
+"""
+Endgame tablebases for king and queen, king and rook and king and pawn against a lone king, made by retrograde analysis:
+starting from the mates, positions are scored backwards one ply at a time, so every position gets its exact distance to mate.
+Each table is a file of one byte per position, memory-mapped so all processes share the same pages.
+
+    python -m Chess.Tablebase generate [--dir path]    writes KQK.bin, KRK.bin and KPK.bin (KPK needs the other two)
+    python -m Chess.Tablebase probe "<fen>"
+
+A table is indexed by side to move, the strong side's king, the lone king and the piece, always with the strong side
+as white (black's positions are mirrored). A byte is 0 for a draw, otherwise plies to mate + 1: a win when the strong
+side is to move, a loss when the lone king is. Castling rights and the fifty-move rule are left out.
+"""
+
+import argparse
+import mmap
+import os
+import time
+
+from Chess import BitboardEngine
+
+TABLEBASE_DIR = os.path.join(os.path.dirname(__file__), "tablebases")
+TABLES = {"q": "KQK", "r": "KRK", "p": "KPK"}  # the strong side's piece and the table that has it
+MAX_PIECES = 3
+SIZE = 2 * 64 * 64 * 64
+
+KING_NEAR = []  # squares a king on each square attacks
+for sq in range(64):
+    KING_NEAR.append([r * 8 + c for r in range(sq // 8 - 1, sq // 8 + 2) for c in range(sq % 8 - 1, sq % 8 + 2)
+                      if 0 <= r < 8 and 0 <= c < 8 and r * 8 + c != sq])
+KING_MASK = [sum(1 << t for t in near) for near in KING_NEAR]
+PAWN_MASK = [sum(1 << (sq - 9 + dc) for dc in (0, 2) if 0 <= sq % 8 - 1 + dc < 8) if sq >= 8 else 0
+             for sq in range(64)]  # squares a white pawn attacks
+
+# rays of squares from each square, and for every pair of squares on a line the squares between them (-1 off the line)
+ROOK_DIRS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+QUEEN_DIRS = ROOK_DIRS + ((-1, -1), (-1, 1), (1, -1), (1, 1))
+RAYS = {}
+BETWEEN = {}
+for piece, dirs in (("r", ROOK_DIRS), ("q", QUEEN_DIRS)):
+    RAYS[piece] = []
+    BETWEEN[piece] = [-1] * 4096
+    for sq in range(64):
+        rays = []
+        for dr, dc in dirs:
+            ray = []
+            r, c = sq // 8 + dr, sq % 8 + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                ray.append(r * 8 + c)
+                r, c = r + dr, c + dc
+            rays.append(ray)
+            mask = 0
+            for t in ray:
+                BETWEEN[piece][sq * 64 + t] = mask
+                mask |= 1 << t
+        RAYS[piece].append(rays)
+
+
+def index(blackToMove, wk, bk, sq):
+    return ((blackToMove * 64 + wk) * 64 + bk) * 64 + sq
+
+
+"""
+True when the white piece on sq attacks target, the white king on wk being the only thing that can block it
+"""
+
+
+def attacks(piece, sq, target, wk):
+    if piece == "p":
+        return PAWN_MASK[sq] >> target & 1
+    between = BETWEEN[piece][sq * 64 + target]
+    return between >= 0 and not between >> wk & 1
+
+
+"""
+Builds the table for the piece, returns a bytearray. The pawn table reads the queen and rook tables for promotions.
+"""
+
+
+def generate(piece, promotions=None):
+    table = bytearray(SIZE)
+    legal = bytearray(SIZE)
+    counts = bytearray(SIZE)  # black moves left to be proven lost, 9 once black has a draw
+    buckets = [[]]  # positions by the plies to mate they'll get
+    pawn = piece == "p"
+
+    for wk in range(64):
+        for bk in range(64):
+            if bk == wk or KING_MASK[wk] >> bk & 1:
+                continue
+            for sq in range(8, 56) if pawn else range(64):
+                if sq == wk or sq == bk:
+                    continue
+                check = attacks(piece, sq, bk, wk)
+                if not check:
+                    legal[index(0, wk, bk, sq)] = 1
+                i = index(1, wk, bk, sq)
+                legal[i] = 1
+                count = 0
+                for t in KING_NEAR[bk]:
+                    if t == wk or KING_MASK[wk] >> t & 1:
+                        continue
+                    if t == sq:
+                        if not KING_MASK[wk] >> sq & 1:
+                            count = 9  # takes the piece, a draw
+                            break
+                    elif not attacks(piece, sq, t, wk):
+                        count += 1
+                counts[i] = count
+                if count == 0 and check:
+                    buckets[0].append(i)
+
+    if pawn:
+        # promotions: wins in the queen or rook table one ply later
+        for wk in range(64):
+            for bk in range(64):
+                for sq in range(8, 16):
+                    i = index(0, wk, bk, sq)
+                    if not legal[i] or sq - 8 in (wk, bk):
+                        continue
+                    for other in promotions:
+                        value = other[index(1, wk, bk, sq - 8)]
+                        if value:
+                            while len(buckets) <= value:
+                                buckets.append([])
+                            buckets[value].append(i)
+
+    plies = 0
+    while plies < len(buckets):
+        if plies + 1 == len(buckets):
+            buckets.append([])
+        nextbucket = buckets[plies + 1]
+        for i in buckets[plies]:
+            if table[i]:
+                continue
+            table[i] = plies + 1
+            sq, bk, wk = i & 63, i >> 6 & 63, i >> 12 & 63
+            if i >> 18:
+                # black to move and lost, white wins from every position that can move here
+                for s in KING_NEAR[wk]:
+                    if s != bk and s != sq and not KING_MASK[bk] >> s & 1:
+                        j = index(0, s, bk, sq)
+                        if legal[j] == 1 and not table[j]:
+                            legal[j] = 2  # queued
+                            nextbucket.append(j)
+                if pawn:
+                    froms = []
+                    if sq < 48 and sq + 8 not in (wk, bk):
+                        froms.append(sq + 8)
+                        if 32 <= sq < 40 and sq + 16 not in (wk, bk):
+                            froms.append(sq + 16)
+                else:
+                    froms = []
+                    for ray in RAYS[piece][sq]:
+                        for s in ray:
+                            if s == wk or s == bk:
+                                break
+                            froms.append(s)
+                for s in froms:
+                    j = index(0, wk, bk, s)
+                    if legal[j] == 1 and not table[j]:
+                        legal[j] = 2
+                        nextbucket.append(j)
+            else:
+                # white to move and winning, one black move less to refute in every position that can move here
+                for s in KING_NEAR[bk]:
+                    if s != wk and s != sq and not KING_MASK[wk] >> s & 1:
+                        j = index(1, wk, s, sq)
+                        if counts[j] < 9 and not table[j]:
+                            counts[j] -= 1
+                            if counts[j] == 0:
+                                nextbucket.append(j)
+        if not nextbucket and plies + 2 == len(buckets):
+            break
+        plies += 1
+    return table
+
+
+class Tablebases:
+
+    def __init__(self, path=TABLEBASE_DIR):
+        self.path = path
+        self.files = []
+        self.tables = {}
+        for piece, name in TABLES.items():
+            filename = os.path.join(path, name + ".bin")
+            if os.path.exists(filename):
+                f = open(filename, "rb")
+                self.files.append(f)
+                self.tables[piece] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        for f in self.files:
+            f.close()
+        self.tables = {}
+        self.files = []
+
+    """
+    (1 win / 0 draw / -1 loss for the side to move, plies to mate) for a position with a table, else None
+    """
+
+    def probe(self, gs):
+        if gs.pieces > MAX_PIECES or gs.castle:
+            return None
+        strong = None
+        sq = 0
+        for row in gs.board:
+            for piece in row:
+                if piece != '--':
+                    if piece[1] == 'k':
+                        if piece[0] == 'w':
+                            wk = sq
+                        else:
+                            bk = sq
+                    else:
+                        strong = piece
+                        psq = sq
+                sq += 1
+        if strong is None or strong[1] not in self.tables:
+            return None
+        blackToMove = not gs.whiteToMove
+        if strong[0] == 'b':
+            # mirrored so the piece is white's
+            wk, bk, psq = bk ^ 56, wk ^ 56, psq ^ 56
+            blackToMove = not blackToMove
+        value = self.tables[strong[1]][index(blackToMove, wk, bk, psq)]
+        if not value:
+            return 0, 0
+        return (-1 if blackToMove else 1), value - 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Chess.Tablebase", description="KQK, KRK and KPK tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="generate the tables")
+    build.add_argument("--dir", default=TABLEBASE_DIR)
+    probe = commands.add_parser("probe", help="look up a position")
+    probe.add_argument("fen")
+    probe.add_argument("--dir", default=TABLEBASE_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        os.makedirs(args.dir, exist_ok=True)
+        done = {}
+        for piece, name in TABLES.items():
+            start = time.perf_counter()
+            done[piece] = generate(piece, [done["q"], done["r"]] if piece == "p" else None)
+            with open(os.path.join(args.dir, name + ".bin"), "wb") as f:
+                f.write(done[piece])
+            wins = sum(1 for value in done[piece][:SIZE // 2] if value)
+            print("%s  %6d white wins  longest mate %d plies  %.1fs" %
+                  (name, wins, max(done[piece]) - 1, time.perf_counter() - start))
+    else:
+        tablebases = Tablebases(args.dir)
+        found = tablebases.probe(BitboardEngine.GameState.from_fen(args.fen))
+        if found is None:
+            print("not in the tables")
+        elif found[0] == 0:
+            print("draw")
+        else:
+            print("%s, mate in %d plies" % ("win" if found[0] > 0 else "loss", found[1]))
+        tablebases.close()
+
+
+if __name__ == '__main__':
+    main()
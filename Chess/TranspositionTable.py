@@ -0,0 +1,117 @@
+"""
+Fixed size transposition table for the search.
+The table is split in buckets of two entries: the first one keeps the deepest search of the
+position (depth-preferred) and the second one is overwritten by every store that doesn't
+make it into the first (always-replace).
+Each entry is two 64-bit words, the Zobrist key and the packed data, kept in flat arrays,
+so the memory used is fixed when the table is created and never grows.
+The key word is stored xor'ed with the data word, so an entry half written by another process
+sharing the table (see ParallelSearch) doesn't match any key and is never used.
+"""
+
+from array import array
+
+# bound types, 0 marks an empty entry
+EXACT = 1
+LOWER = 2  # the score is at least this much (fail high)
+UPPER = 3  # the score is at most this much (fail low)
+
+ENTRY_SIZE = 16  # bytes, key + data
+SCORE_OFFSET = 1 << 31
+
+"""
+Data word layout:
+    bits  0-15  move id
+    bits 16-23  depth
+    bits 24-25  bound type
+    bits 26-31  age of the search that stored it
+    bits 32-63  score + SCORE_OFFSET
+"""
+
+
+"""
+Bytes of memory a table of size_mb uses, the size of the buffer to give TranspositionTable
+"""
+
+
+def buffersize(size_mb):
+    return max(1, size_mb * 1024 * 1024 // (2 * ENTRY_SIZE)) * 2 * ENTRY_SIZE
+
+
+class TranspositionTable:
+
+    """
+    buffer is an optional writable buffer of buffersize(size_mb) bytes (shared memory for example)
+    to keep the table in, by default the table has its own arrays
+    """
+
+    def __init__(self, size_mb=16, buffer=None):
+        self.buckets = max(1, size_mb * 1024 * 1024 // (2 * ENTRY_SIZE))
+        if buffer is None:
+            self.keys = array('Q', [0]) * (2 * self.buckets)
+            self.data = array('Q', [0]) * (2 * self.buckets)
+        else:
+            words = memoryview(buffer).cast('B').cast('Q')
+            self.keys = words[:2 * self.buckets]
+            self.data = words[2 * self.buckets:4 * self.buckets]
+        self.age = 0
+
+    """
+    Empties the table
+    """
+
+    def clear(self):
+        # zeroed as bytes in one slice assignment, the words may be an array or a view of shared memory
+        for words in (self.keys, self.data):
+            view = memoryview(words).cast('B')
+            view[:] = bytes(len(view))
+            view.release()
+        self.age = 0
+
+    """
+    Call before every new search, entries from older searches are replaced first
+    """
+
+    def newsearch(self):
+        self.age = (self.age + 1) & 63
+
+    """
+    Returns (depth, score, bound, move id) stored for the key, or None
+    """
+
+    def probe(self, key):
+        i = (key % self.buckets) * 2
+        keys = self.keys
+        data = self.data[i]
+        if keys[i] ^ data != key:
+            data = self.data[i + 1]
+            if keys[i + 1] ^ data != key:
+                return None
+        if not data:
+            return None
+        return (data >> 16) & 0xFF, (data >> 32) - SCORE_OFFSET, (data >> 24) & 3, data & 0xFFFF
+
+    def store(self, key, depth, score, bound, move):
+        i = (key % self.buckets) * 2
+        data = self.data[i]
+        samekey = self.keys[i] ^ data == key
+        # the depth-preferred slot only takes the same position, a deeper search or a search from a newer game move
+        if not data or samekey or depth >= (data >> 16) & 0xFF or (data >> 26) & 63 != self.age:
+            if not samekey and data:
+                # the old deep entry still gets a chance in the always-replace slot
+                self.keys[i + 1] = self.keys[i]
+                self.data[i + 1] = data
+        else:
+            i += 1
+        data = (move & 0xFFFF) | (min(depth, 255) << 16) | (bound << 24) | (self.age << 26) | \
+            ((score + SCORE_OFFSET) << 32)
+        self.keys[i] = key ^ data
+        self.data[i] = data
+
+    """
+    Permille of the entries in use, sampled from the first thousand (the "hashfull" UCI engines report)
+    """
+
+    def hashfull(self):
+        sample = min(1000, len(self.data))
+        return sum(1 for i in range(sample) if self.data[i]) * 1000 // sample
@@ -0,0 +1,119 @@
+"""
+Perft: counts the leaf nodes of the legal move tree down to a given depth.
+The counts for the reference positions are known, so it checks the move generator, and the
+nodes per second it reports is the benchmark to compare move generator changes with.
+
+    python -m Chess.perft 4
+    python -m Chess.perft 3 --fen "<fen>" --divide
+    python -m Chess.perft --check --depth 3
+    --engine mailbox runs ChessEngine.GameState instead of BitboardEngine.GameState
+"""
+
+import argparse
+import sys
+import time
+
+from Chess import ChessEngine, BitboardEngine
+
+ENGINES = {"bitboard": BitboardEngine.GameState, "mailbox": ChessEngine.GameState}
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# name, FEN and the leaf counts from depth 1 on (the Chess Programming Wiki perft results)
+POSITIONS = [
+    ("start", STARTING_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 4 mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+"""
+Perft split by root move, the first thing to compare against another engine when a count is off
+"""
+
+
+def divide(gs, depth):
+    counts = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts.append((move.getUciNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return counts
+
+
+def timed(gs, depth, split=False):
+    start = time.perf_counter()
+    if split:
+        counts = divide(gs, depth)
+        for name, nodes in sorted(counts):
+            print("%s: %d" % (name, nodes))
+        nodes = sum(nodes for name, nodes in counts)
+        print("\nmoves: %d" % len(counts))
+    else:
+        nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+
+"""
+Runs the reference positions up to depth (or as deep as the known counts go), True if every count matches
+"""
+
+
+def check(depth, gamestate):
+    ok = True
+    for name, fen, counts in POSITIONS:
+        for d in range(1, min(depth, len(counts)) + 1):
+            nodes, elapsed = timed(gamestate.from_fen(fen), d)
+            status = "ok" if nodes == counts[d - 1] else "FAIL, expected %d" % counts[d - 1]
+            print("%-20s depth %d  %10d nodes  %7.2fs  %8d nps  %s" %
+                  (name, d, nodes, elapsed, nodes / max(elapsed, 1e-9), status))
+            ok = ok and nodes == counts[d - 1]
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Chess.perft", description="Count the leaf nodes of the move tree")
+    parser.add_argument("depth", nargs="?", type=int, default=3)
+    parser.add_argument("--depth", dest="maxdepth", type=int, help="deepest depth for --check (default 3)")
+    parser.add_argument("--fen", default=STARTING_FEN)
+    parser.add_argument("--divide", action="store_true", help="print the count under every root move")
+    parser.add_argument("--check", action="store_true", help="run the reference positions and compare the counts")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="bitboard")
+    args = parser.parse_args(argv)
+
+    gamestate = ENGINES[args.engine]
+    if args.check:
+        return 0 if check(args.maxdepth or args.depth, gamestate) else 1
+
+    nodes, elapsed = timed(gamestate.from_fen(args.fen), args.depth, args.divide)
+    print("nodes: %d\ntime: %.2fs\nnps: %d" % (nodes, elapsed, nodes / max(elapsed, 1e-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
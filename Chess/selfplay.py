@@ -0,0 +1,191 @@
+"""
+Headless self-play: engine A against engine B over many games on a process pool, to measure engine changes.
+The sides differ by search depth and/or time per move. Games are played in pairs from the same random opening with
+the colors swapped, and end on mate, stalemate, threefold repetition, the fifty-move rule or the ply limit.
+Each finished game is written out right away (PGN and/or JSON lines). At the end the Elo difference of A over B
+is printed with a 95% error bar, along with the nodes per second of all the processes together.
+
+    python -m Chess.selfplay --games 100 --depth 3 --depth-b 2 --pgn games.pgn --jsonl games.jsonl
+"""
+
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+from Chess import BitboardEngine, PgnIO, SmartMoveFinder
+
+
+class SelfPlayStats:
+
+    def __init__(self):
+        self.wins = self.draws = self.losses = 0  # from A's side
+        self.nodes = 0
+        self.searchtime = 0  # seconds spent searching, added up over the processes
+        self.elapsed = 0  # wall clock seconds for the match
+
+    def add(self, record):
+        score = {"1-0": 1, "0-1": 0}.get(record["result"], 0.5)
+        if record["white"] != "A":
+            score = 1 - score
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        self.nodes += record["nodes"]
+        self.searchtime += record["seconds"]
+
+    """
+    Elo difference of A over B with the 95% confidence interval, as (low, elo, high)
+    """
+
+    def elo(self):
+        games = self.wins + self.draws + self.losses
+        if not games:
+            return 0, 0, 0
+        score = (self.wins + self.draws / 2) / games
+        variance = (self.wins * (1 - score) ** 2 + self.draws * (0.5 - score) ** 2 +
+                    self.losses * score ** 2) / games
+        margin = 1.96 * math.sqrt(variance / games)
+        return eloscore(score - margin), eloscore(score), eloscore(score + margin)
+
+
+def eloscore(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+
+"""
+Plays one game in a worker process, returns its record for the JSON lines output with the PGN text under "pgn"
+"""
+
+
+def playgame(game):
+    index, white, black, openingseed, openingplies, maxplies = game
+    gs = BitboardEngine.GameState()
+    SmartMoveFinder.tt.clear()
+    moves = []
+    nodes = 0
+    seconds = 0
+    rng = random.Random(openingseed)
+    termination = "max plies"
+    while len(moves) < maxplies:
+        validmoves = gs.getValidMoves()
+        if gs.checkmate or gs.stalemate:
+            termination = "checkmate" if gs.checkmate else "stalemate"
+            break
+        if gs.drawReason() is not None:
+            termination = gs.drawReason()
+            break
+        if len(moves) < openingplies:
+            move = rng.choice(validmoves)
+        else:
+            side = white if gs.whiteToMove else black
+            start = time.perf_counter()
+            move = SmartMoveFinder.findbestmove(gs, validmoves, side["time"], side["depth"])
+            seconds += time.perf_counter() - start
+            nodes += SmartMoveFinder.nodes
+            if move is None:
+                move = validmoves[0]
+        gs.makeMove(move)
+        moves.append(move)
+
+    if termination == "checkmate":
+        result = "0-1" if gs.whiteToMove else "1-0"
+    else:
+        result = "1/2-1/2"
+    pgn = io.StringIO()
+    PgnIO.writegame(pgn, moves, {"Event": "selfplay", "Round": str(index + 1), "White": describe(white),
+                                 "Black": describe(black), "Termination": termination}, result)
+    return {"game": index + 1, "white": white["name"], "black": black["name"], "result": result,
+            "termination": termination, "plies": len(moves), "nodes": nodes, "seconds": round(seconds, 3),
+            "moves": [move.getUciNotation() for move in moves], "pgn": pgn.getvalue()}
+
+
+def describe(side):
+    text = "%s depth %d" % (side["name"], side["depth"])
+    if side["time"] is not None:
+        text += " time %gs" % side["time"]
+    return text
+
+
+"""
+Plays the match and streams the games out, returns the stats
+"""
+
+
+def selfplay(games, engineA, engineB, workers=None, openingplies=4, maxplies=300, seed=0, pgn=None, jsonl=None,
+             verbose=True):
+    # pairs of games share an opening, A is white in the first one
+    schedule = []
+    for index in range(games):
+        white, black = (engineA, engineB) if index % 2 == 0 else (engineB, engineA)
+        schedule.append((index, white, black, seed * 100003 + index // 2, openingplies, maxplies))
+
+    stats = SelfPlayStats()
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers or os.cpu_count() or 1) as pool:
+        for record in pool.imap_unordered(playgame, schedule):
+            stats.add(record)
+            text = record.pop("pgn")
+            if pgn is not None:
+                pgn.write(text)
+                pgn.flush()
+            if jsonl is not None:
+                jsonl.write(json.dumps(record) + "\n")
+                jsonl.flush()
+            if verbose:
+                played = stats.wins + stats.draws + stats.losses
+                print("game %d/%d  %s-%s %s (%s, %d plies)  A +%d =%d -%d" %
+                      (played, games, record["white"], record["black"], record["result"], record["termination"],
+                       record["plies"], stats.wins, stats.draws, stats.losses))
+    stats.elapsed = time.perf_counter() - start
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Chess.selfplay", description="engine A against engine B")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None, help="processes, all the CPUs by default")
+    parser.add_argument("--depth", type=int, default=SmartMoveFinder.DEPTH, help="engine A's search depth")
+    parser.add_argument("--depth-b", type=int, default=None, help="engine B's search depth, A's by default")
+    parser.add_argument("--time", type=float, default=None, help="engine A's seconds per move")
+    parser.add_argument("--time-b", type=float, default=None, help="engine B's seconds per move")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random moves before the engines take over")
+    parser.add_argument("--max-plies", type=int, default=300, help="games this long are called a draw")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pgn", help="PGN file to write the games to")
+    parser.add_argument("--jsonl", help="JSON lines file to write the games to")
+    args = parser.parse_args(argv)
+
+    engineA = {"name": "A", "depth": args.depth, "time": args.time}
+    engineB = {"name": "B", "depth": args.depth_b if args.depth_b is not None else args.depth,
+               "time": args.time_b if args.time_b is not None else args.time}
+    pgn = open(args.pgn, "w") if args.pgn else None
+    jsonl = open(args.jsonl, "w") if args.jsonl else None
+    try:
+        stats = selfplay(args.games, engineA, engineB, args.workers, args.opening_plies, args.max_plies, args.seed,
+                         pgn, jsonl)
+    finally:
+        for f in (pgn, jsonl):
+            if f is not None:
+                f.close()
+
+    low, elo, high = stats.elo()
+    print("A: %s\nB: %s" % (describe(engineA), describe(engineB)))
+    print("A +%d =%d -%d  Elo %+.1f  (95%%: %+.1f to %+.1f)" % (stats.wins, stats.draws, stats.losses, elo, low, high))
+    print("nodes: %d  time: %.1fs  nps: %d (%d per process)" %
+          (stats.nodes, stats.elapsed, stats.nodes / max(stats.elapsed, 1e-9), stats.nodes / max(stats.searchtime, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
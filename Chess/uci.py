@@ -0,0 +1,240 @@
+"""
+UCI (Universal Chess Interface) front end, so the engine can be run by chess GUIs and tournament managers:
+
+    python -m Chess.uci
+
+Supported: uci, isready, ucinewgame, setoption name Hash/Threads value <n>, setoption name BookFile/TablebasePath value <path>,
+position [startpos | fen <fen>] [moves ...], go [depth N] [movetime ms] [wtime ms] [btime ms] [winc ms] [binc ms]
+[movestogo N] [infinite], stop, quit.
+The search runs on a worker thread, the main thread keeps reading commands so stop is seen right away.
+"""
+
+import sys
+import threading
+
+from Chess import BitboardEngine, SmartMoveFinder, ParallelSearch
+
+ENGINE_NAME = "Python-Chess-AI"
+ENGINE_AUTHOR = "sevenalarm"
+DEFAULT_MOVES_TO_GO = 30  # moves left to plan for when the GUI only sends the clock
+MOVE_OVERHEAD = 0.05  # seconds kept back for the GUI and the pipe
+
+
+class UciEngine:
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.gs = BitboardEngine.GameState()
+        self.worker = None
+        self.stopped = threading.Event()  # set by stop, an infinite search holds its bestmove until then
+        self.hash = SmartMoveFinder.TT_SIZE_MB
+        self.threads = 1
+        self.parallel = None  # ParallelSearch when Threads is over 1
+
+    def send(self, line):
+        self.out.write(line + "\n")
+        self.out.flush()
+
+    """
+    Handles one command line, returns False on quit.
+    A line that can't be parsed is reported as an info string, the position and options stay as they were.
+    """
+
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        try:
+            return self.dispatch(tokens[0], tokens[1:])
+        except (ValueError, IndexError, KeyError, OSError) as e:
+            self.send("info string %s" % e)
+            return True
+
+    def dispatch(self, command, args):
+        if command == "uci":
+            self.send("id name %s" % ENGINE_NAME)
+            self.send("id author %s" % ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 1024" % SmartMoveFinder.TT_SIZE_MB)
+            self.send("option name Threads type spin default 1 min 1 max 64")
+            self.send("option name BookFile type string default %s" %
+                      (SmartMoveFinder.book.path if SmartMoveFinder.book is not None else "<empty>"))
+            self.send("option name TablebasePath type string default %s" %
+                      (SmartMoveFinder.tablebases.path if SmartMoveFinder.tablebases is not None else "<empty>"))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop()
+            SmartMoveFinder.tt.clear()
+            if self.parallel is not None:
+                self.parallel.tt.clear()
+            self.gs = BitboardEngine.GameState()
+        elif command == "setoption":
+            self.setoption(args)
+        elif command == "position":
+            self.stop()
+            self.position(args)
+        elif command == "go":
+            self.stop()
+            self.go(args)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            self.setthreads(1)
+            return False
+        elif command == "d":  # not UCI, handy when driving the engine by hand
+            self.send(self.gs.to_fen())
+        return True
+
+    def setoption(self, args):
+        if "name" in args and "value" in args:
+            name = " ".join(args[args.index("name") + 1:args.index("value")]).lower()
+            value = " ".join(args[args.index("value") + 1:])
+            if name == "hash":
+                size = max(1, int(value))
+                self.stop()
+                self.hash = size
+                SmartMoveFinder.resizett(self.hash)
+                self.setthreads(self.threads, True)
+            elif name == "threads":
+                threads = max(1, int(value))
+                self.stop()
+                self.setthreads(threads)
+            elif name == "bookfile":
+                self.stop()
+                SmartMoveFinder.loadbook(None if value in ("", "<empty>") else value)
+            elif name == "tablebasepath":
+                self.stop()
+                SmartMoveFinder.loadtablebases(None if value in ("", "<empty>") else value)
+
+    """
+    More than one thread searches with a ParallelSearch of that many processes, remade when the hash size changes
+    """
+
+    def setthreads(self, threads, rebuild=False):
+        if self.parallel is not None and (rebuild or threads != self.threads):
+            self.parallel.close()
+            self.parallel = None
+        self.threads = threads
+        if threads > 1 and self.parallel is None:
+            self.parallel = ParallelSearch.ParallelSearch(threads, self.hash)
+
+    def position(self, args):
+        if args and args[0] == "fen":
+            end = args.index("moves") if "moves" in args else len(args)
+            gs = BitboardEngine.GameState.from_fen(" ".join(args[1:end]))
+        else:
+            gs = BitboardEngine.GameState()
+        if "moves" in args:
+            for text in args[args.index("moves") + 1:]:
+                move = findmove(gs.getValidMoves(), text)
+                if move is None:
+                    # the whole command is dropped, the position stays as it was
+                    self.send("info string illegal move %s" % text)
+                    return
+                gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, args):
+        options = {}
+        i = 0
+        while i < len(args):
+            if args[i] in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes", "mate") and \
+                    i + 1 < len(args):
+                options[args[i]] = int(args[i + 1])
+                i += 2
+            else:
+                options[args[i]] = True
+                i += 1
+
+        depth = options.get("depth", SmartMoveFinder.MAX_PLY)
+        if "movetime" in options:
+            time_limit = max(0.01, options["movetime"] / 1000 - MOVE_OVERHEAD)
+        elif ("wtime" if self.gs.whiteToMove else "btime") in options and "infinite" not in options:
+            left = options["wtime" if self.gs.whiteToMove else "btime"] / 1000
+            inc = options.get("winc" if self.gs.whiteToMove else "binc", 0) / 1000
+            togo = options.get("movestogo", DEFAULT_MOVES_TO_GO)
+            time_limit = max(0.01, min(left / togo + inc * 0.8, left / 2) - MOVE_OVERHEAD)
+        else:
+            time_limit = None
+            if "depth" not in options and "infinite" not in options:
+                depth = SmartMoveFinder.DEPTH
+
+        self.stopped.clear()
+        self.worker = threading.Thread(target=self.search, args=(self.gs, time_limit, depth, "infinite" in options),
+                                       daemon=True)
+        self.worker.start()
+
+    """
+    Runs on the worker thread, prints info lines while searching and bestmove at the end.
+    An infinite search sends bestmove only once stop (or quit) comes, even when the search itself ended sooner.
+    """
+
+    def search(self, gs, time_limit, depth, infinite=False):
+        validmoves = gs.getValidMoves()
+        if not validmoves:
+            self.send("info depth 0 score %s" % ("mate 0" if gs.checkmate else "cp 0"))
+            if infinite:
+                self.stopped.wait()
+            self.send("bestmove 0000")
+            return
+
+        def info(depth, score, nodes, seconds):
+            pv = SmartMoveFinder.principalvariation(gs, depth)
+            self.send("info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s" %
+                      (depth, scoretext(score), nodes, nodes / max(seconds, 1e-6), seconds * 1000,
+                       SmartMoveFinder.tt.hashfull(), " ".join(move.getUciNotation() for move in pv)))
+
+        if self.parallel is not None:
+            move = self.parallel.findbestmove(gs, validmoves, time_limit, depth, info)
+        else:
+            move = SmartMoveFinder.findbestmove(gs, validmoves, time_limit, depth, info)
+        if move is None:
+            move = validmoves[0]
+        if infinite:
+            self.stopped.wait()
+        self.send("bestmove %s" % move.getUciNotation())
+
+    """
+    Stops a running search and waits for its bestmove
+    """
+
+    def stop(self):
+        self.stopped.set()
+        while self.worker is not None and self.worker.is_alive():
+            # findbestmove clears the flag when it starts, so keep setting it until the thread is gone
+            SmartMoveFinder.stopsearch = True
+            self.worker.join(0.01)
+        self.worker = None
+
+
+def findmove(validmoves, text):
+    for move in validmoves:
+        if move.getUciNotation() == text:
+            return move
+    return None
+
+
+"""
+Score as UCI wants it: centipawns, or moves to mate for mate scores
+"""
+
+
+def scoretext(score):
+    if abs(score) >= SmartMoveFinder.CHECKMATE - SmartMoveFinder.MAX_PLY:
+        plies = SmartMoveFinder.CHECKMATE - abs(score)
+        return "mate %d" % ((plies + 1) // 2 if score > 0 else -((plies + 1) // 2))
+    return "cp %d" % score
+
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Perft counts of the reference positions on both GameState backends, each position as deep as stays under
+NODE_LIMIT leaves so the suite runs in a few seconds, plus positions the move generators got wrong before.
+
+    python -m pytest tests
+"""
+
+import pytest
+
+from Chess import perft
+
+NODE_LIMIT = 100000
+
+CASES = []
+for name, fen, counts in perft.POSITIONS:
+    depth = max(d for d in range(1, len(counts) + 1) if counts[d - 1] <= NODE_LIMIT)
+    CASES.append(pytest.param(fen, depth, counts[depth - 1], id="%s-d%d" % (name, depth)))
+
+# FEN, the number of legal moves and the move a generator used to miss
+REGRESSIONS = [
+    # white pawn pinned along its file with the king in front of it, the push stays on the pin line
+    ("7k/8/8/p1K4p/P5nP/2P5/8/2r5 w - - 10 98", 8, "c3c4"),
+    # the same for a black pawn
+    ("1R3b2/8/1p3p2/2r5/PkP3pP/5Bn1/K7/2R5 b - - 0 1", 26, "b6b5"),
+]
+
+
+@pytest.mark.parametrize("engine", sorted(perft.ENGINES))
+@pytest.mark.parametrize("fen, depth, expected", CASES)
+def test_reference_positions(engine, fen, depth, expected):
+    assert perft.perft(perft.ENGINES[engine].from_fen(fen), depth) == expected
+
+
+@pytest.mark.parametrize("engine", sorted(perft.ENGINES))
+@pytest.mark.parametrize("fen, moves, missed", REGRESSIONS)
+def test_regressions(engine, fen, moves, missed):
+    found = [move.getUciNotation() for move in perft.ENGINES[engine].from_fen(fen).getValidMoves()]
+    assert len(found) == moves
+    assert missed in found
+
+
+@pytest.mark.parametrize("fen, moves, missed", REGRESSIONS)
+def test_backends_agree(fen, moves, missed):
+    counts = [sorted(perft.divide(perft.ENGINES[engine].from_fen(fen), 2)) for engine in sorted(perft.ENGINES)]
+    assert counts[0] == counts[1]
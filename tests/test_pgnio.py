@@ -0,0 +1,28 @@
+"""
+PGN reading: comments that run over several lines stay part of their game
+"""
+
+from Chess import PgnIO
+
+WRAPPED_COMMENT = """[Event "wrapped"]
+[Result "1-0"]
+
+1. e4 { opening
+[%clk 0:03:00] } e5 2. Nf3 Nc6 1-0
+
+[Event "next"]
+
+1. d4 ; a { in a line comment doesn't open one
+d5 0-1
+"""
+
+
+def test_wrapped_comment_with_clock():
+    games = list(PgnIO.readgames(WRAPPED_COMMENT.splitlines()))
+    assert len(games) == 2
+    assert games[0].headers["Event"] == "wrapped"
+    assert games[0].moves == ["e4", "e5", "Nf3", "Nc6"]
+    assert games[0].result == "1-0"
+    assert games[1].headers["Event"] == "next"
+    assert games[1].moves == ["d4", "d5"]
+    assert games[1].result == "0-1"